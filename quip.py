@@ -29,39 +29,57 @@ to append items (in Markdown) to the first bulleted or checklist in a
 given document, which is useful for automating a task list.
 """
 
+import bisect
+import collections
+import contextlib
 import datetime
+import io
 import json
 import logging
+import socket
 import ssl
 import sys
+import threading
 import time
 import xml.etree.cElementTree
-from tenacity import retry, wait_fixed, stop_after_attempt
 import random
-
-ssl._create_default_https_context = ssl._create_unverified_context
+import re
+import zlib
 PY3 = sys.version_info > (3,)
 
 if PY3:
+    import http.client
     import urllib.request
     import urllib.parse
     import urllib.error
 
     Request = urllib.request.Request
     urlencode = urllib.parse.urlencode
+    urlsplit = urllib.parse.urlsplit
     urlopen = urllib.request.urlopen
     HTTPError = urllib.error.HTTPError
+    URLError = urllib.error.URLError
+    HTTPConnection = http.client.HTTPConnection
+    HTTPSConnection = http.client.HTTPSConnection
+    HTTPException = http.client.HTTPException
 
     iteritems = dict.items
 
 else:
+    import httplib
     import urllib
     import urllib2
+    import urlparse
 
     Request = urllib2.Request
     urlencode = urllib.urlencode
+    urlsplit = urlparse.urlsplit
     urlopen = urllib2.urlopen
     HTTPError = urllib2.HTTPError
+    URLError = urllib2.URLError
+    HTTPConnection = httplib.HTTPConnection
+    HTTPSConnection = httplib.HTTPSConnection
+    HTTPException = httplib.HTTPException
 
     iteritems = dict.iteritems
 
@@ -72,6 +90,14 @@ except:
     # Can't change default encoding usually...
     pass
 
+try:
+    # orjson decodes large thread payloads several times faster than json.
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 try:
     ssl.PROTOCOL_TLSv1_1
 except AttributeError:
@@ -107,8 +133,1231 @@ class QuipError(Exception):
         self.http_error = http_error
 
 
+class ConnectionPool(object):
+    """A thread-safe pool of persistent HTTP(S) connections.
+
+    Connections are kept alive between requests and reused per host, so
+    consecutive API calls skip the TCP and TLS handshakes. A single pool can
+    be shared by any number of `QuipClient` instances and threads:
+
+        pool = quip.ConnectionPool(max_connections=20)
+        client = quip.QuipClient(access_token=..., connection_pool=pool)
+
+    `max_connections` bounds the number of open connections per host; callers
+    block until a connection is free. Idle connections older than
+    `idle_timeout` seconds are closed instead of being reused.
+    """
+
+    def __init__(self, max_connections=10, idle_timeout=60, ssl_context=None):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context
+        self._condition = threading.Condition()
+        self._idle = {}
+        self._active = {}
+
+    def urlopen(self, url, data=None, headers=None, timeout=None,
+                method=None):
+        """Performs a request and returns a file-like `PooledResponse`.
+
+        Mirrors `urlopen`: the request is a POST if `data` is given, and
+        `HTTPError` is raised for error statuses. A body that is neither
+        bytes nor a `MultipartEncoder` that can rewind is always sent on a
+        new connection, as it could not be sent again if an idle one turned
+        out to be closed.
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname,
+               parts.port or (443 if parts.scheme == "https" else 80))
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        method = method or ("POST" if data is not None else "GET")
+        headers = dict(headers or {})
+        if data is not None and method == "POST":
+            headers.setdefault(
+                "Content-Type", "application/x-www-form-urlencoded")
+        replayable = isinstance(data, (bytes, type(None))) or \
+            getattr(data, "rewindable", False)
+        while True:
+            conn, reused = self._acquire(key, timeout, fresh=not replayable)
+            try:
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                conn.timeout = timeout
+                conn.request(method, path, data, headers)
+                response = conn.getresponse()
+            except (HTTPException, socket.error):
+                self._release(key, conn, reusable=False)
+                # The server may have dropped a connection while it sat idle
+                # in the pool; retry those once on a fresh connection.
+                if reused and replayable:
+                    if not isinstance(data, (bytes, type(None))):
+                        data.rewind()
+                    continue
+                raise
+            break
+        response = PooledResponse(self, key, conn, response, url)
+        if response.status >= 400:
+            body = response.read()
+            raise HTTPError(url, response.status, response.reason,
+                            response.headers, io.BytesIO(body))
+        return response
+
+    def close(self):
+        """Closes every idle connection in the pool."""
+        with self._condition:
+            for connections in self._idle.values():
+                for conn, _ in connections:
+                    conn.close()
+            self._idle.clear()
+
+    def _acquire(self, key, timeout, fresh=False):
+        deadline = time.time() + timeout if timeout else None
+        with self._condition:
+            while True:
+                idle = self._idle.get(key) if not fresh else None
+                now = time.time()
+                while idle:
+                    conn, last_used = idle.pop()
+                    if now - last_used < self.idle_timeout:
+                        self._active[key] = self._active.get(key, 0) + 1
+                        return conn, True
+                    conn.close()
+                if self._active.get(key, 0) < self.max_connections:
+                    self._active[key] = self._active.get(key, 0) + 1
+                    return self._new_connection(key), False
+                remaining = deadline - now if deadline else None
+                if remaining is not None and remaining <= 0:
+                    raise socket.timeout(
+                        "Timed out waiting for a pooled connection to %s" %
+                        key[1])
+                self._condition.wait(remaining)
+
+    def _release(self, key, conn, reusable):
+        with self._condition:
+            self._active[key] -= 1
+            if reusable:
+                self._idle.setdefault(key, []).append((conn, time.time()))
+            else:
+                conn.close()
+            self._condition.notify()
+
+    def _new_connection(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return HTTPSConnection(host, port, context=self.ssl_context)
+        return HTTPConnection(host, port)
+
+
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def shared_connection_pool(ssl_context=None):
+    """Returns the process-wide `ConnectionPool` for the given SSL context,
+    which thread-safe `QuipClient`s without a pool of their own share.
+    """
+    with _shared_pools_lock:
+        pool = _shared_pools.get(ssl_context)
+        if pool is None:
+            pool = _shared_pools[ssl_context] = ConnectionPool(
+                max_connections=64, ssl_context=ssl_context)
+        return pool
+
+
+class PooledResponse(object):
+    """A file-like response whose connection returns to its `ConnectionPool`
+    once the body has been read completely or the response is closed.
+
+    Supports the parts of the `urlopen` response interface used by the
+    client: `read`, `close`, `getcode`, `info` and `geturl`.
+    """
+
+    def __init__(self, pool, key, conn, response, url):
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+        self.url = url
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+
+    def read(self, amt=None):
+        if self._conn is None:
+            return b""
+        try:
+            data = self._response.read(amt)
+        except Exception:
+            self._finish(reusable=False)
+            raise
+        if self._response.isclosed():
+            self._finish(reusable=not self._response.will_close)
+        return data
+
+    def close(self):
+        if self._conn is not None:
+            self._finish(reusable=self._response.isclosed() and
+                         not self._response.will_close)
+
+    def getcode(self):
+        return self.status
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def __iter__(self):
+        return iter(lambda: self.read(io.DEFAULT_BUFFER_SIZE), b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _finish(self, reusable):
+        conn, self._conn = self._conn, None
+        self._pool._release(self._key, conn, reusable)
+
+
+class _MeteredResponse(object):
+    """Wraps a response to count the bytes read from it, and calls `done`
+    with the count once the body has been read or the response is closed.
+    """
+
+    def __init__(self, response, done):
+        self._response = response
+        self._done = done
+        self.bytes_read = 0
+
+    def read(self, amt=None):
+        data = self._response.read() if amt is None else \
+            self._response.read(amt)
+        self.bytes_read += len(data)
+        if amt is None or not data:
+            self._finish()
+        return data
+
+    def close(self):
+        try:
+            self._response.close()
+        finally:
+            self._finish()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __iter__(self):
+        return iter(lambda: self.read(io.DEFAULT_BUFFER_SIZE), b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _finish(self):
+        done, self._done = self._done, None
+        if done is not None:
+            done(self.bytes_read)
+
+
+class RateLimiter(object):
+    """A thread-safe, client-side scheduler for Quip API requests.
+
+    Before every request, `acquire` waits until the request may be sent:
+
+    - if `rate` is given, requests are spaced out by a token bucket that
+      refills `rate` tokens per second, up to `burst`;
+    - the server's X-Ratelimit-Remaining and X-Ratelimit-Reset headers are
+      tracked, and once the server's budget is spent, requests wait until
+      it resets;
+    - after a 429 or 503 response, every request waits for the server's
+      Retry-After delay.
+
+    Failed requests (429 and 5xx responses and network errors) are retried
+    up to `max_attempts` times in total, with exponential backoff from
+    `backoff` seconds and full jitter, so that workers do not retry in
+    lockstep. One limiter can be shared by many threads and clients:
+
+        limiter = quip.RateLimiter(rate=10, burst=20)
+        client = quip.QuipClient(access_token=..., rate_limiter=limiter)
+
+    `stats` returns the counts of requests, throttled requests (requests
+    that had to wait), rate-limited responses and retries.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, rate=None, burst=None, max_attempts=3, backoff=1,
+                 max_backoff=60):
+        self.rate = rate
+        self.burst = burst if burst else (rate if rate else 1)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._refilled = time.time()
+        self._remaining = None
+        self._reset = 0
+        self._blocked_until = 0
+        self._counters = {
+            "requests": 0,
+            "throttled": 0,
+            "rate_limited": 0,
+            "retried": 0,
+        }
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve(self):
+        """Reserves the next request and returns the number of seconds to
+        wait before sending it, for callers that cannot block in `acquire`.
+        """
+        with self._lock:
+            now = time.time()
+            self._counters["requests"] += 1
+            delay = max(0, self._blocked_until - now)
+            if self.rate:
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._refilled) * self.rate)
+                self._refilled = now
+                # Tokens may go negative: each caller waits off its own debt,
+                # which spaces concurrent callers out evenly.
+                self._tokens -= 1
+                if self._tokens < 0:
+                    delay = max(delay, -self._tokens / self.rate)
+            if self._remaining is not None:
+                if self._reset <= now:
+                    self._remaining = None
+                else:
+                    self._remaining -= 1
+                    if self._remaining < 0:
+                        delay = max(delay, self._reset - now)
+            if delay > 0:
+                self._counters["throttled"] += 1
+            return delay
+
+    def update(self, headers):
+        """Updates the server's budget from the headers of a response."""
+        if headers is None:
+            return
+        remaining = headers.get("X-Ratelimit-Remaining")
+        reset = headers.get("X-Ratelimit-Reset")
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining, reset = int(remaining), float(reset)
+        except ValueError:
+            return
+        with self._lock:
+            self._remaining = remaining
+            self._reset = reset
+
+    def retry_delay(self, attempt, status=None, headers=None):
+        """Returns the number of seconds to wait before retrying a request
+        that failed with the given status (None for network errors) on the
+        given attempt, counted from 0, or None if it should not be retried.
+        """
+        if status is not None and status not in self.RETRY_STATUSES:
+            return None
+        with self._lock:
+            if status in (429, 503):
+                self._counters["rate_limited"] += 1
+            if attempt + 1 >= self.max_attempts:
+                return None
+            self._counters["retried"] += 1
+            delay = random.uniform(
+                0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            retry_after = headers.get("Retry-After") if headers else None
+            if retry_after:
+                try:
+                    delay += float(retry_after)
+                except ValueError:
+                    pass
+                else:
+                    # Hold back every other request as well.
+                    self._blocked_until = max(
+                        self._blocked_until, time.time() + delay)
+            return delay
+
+    def stats(self):
+        """Returns a dict of the counters of this limiter."""
+        with self._lock:
+            return dict(self._counters)
+
+
+RequestRecord = collections.namedtuple(
+    "RequestRecord",
+    ["method", "endpoint", "status", "bytes_in", "bytes_out", "retries",
+     "seconds"])
+
+
+class RequestMetrics(object):
+    """Thread-safe, in-process aggregates of the requests of Quip clients.
+
+    Pass it to a client as `instrumentation`, and every request is recorded
+    as a `RequestRecord`: its method, endpoint template (IDs in the path
+    become "{id}", e.g. "threads/{id}"), final status (0 for network
+    errors), response and request body bytes, retries and wall time,
+    including reading the response. Records are aggregated per endpoint and
+    method into counters and a latency histogram:
+
+        metrics = quip.RequestMetrics()
+        client = quip.QuipClient(access_token=..., instrumentation=metrics)
+        ...
+        print(metrics.report())
+        exposition = metrics.prometheus_text()
+
+    `buckets` are the upper bounds, in seconds, of the histogram buckets.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets if buckets else self.BUCKETS)
+        self._lock = threading.Lock()
+        self._series = collections.OrderedDict()
+
+    def record(self, record):
+        with self._lock:
+            series = self._series.get((record.endpoint, record.method))
+            if series is None:
+                series = self._series[(record.endpoint, record.method)] = {
+                    "count": 0,
+                    "seconds": 0.0,
+                    "buckets": [0] * (len(self.buckets) + 1),
+                    "statuses": {},
+                    "retries": 0,
+                    "bytes_in": 0,
+                    "bytes_out": 0,
+                }
+            series["count"] += 1
+            series["seconds"] += record.seconds
+            series["buckets"][bisect.bisect_left(
+                self.buckets, record.seconds)] += 1
+            series["statuses"][record.status] = \
+                series["statuses"].get(record.status, 0) + 1
+            series["retries"] += record.retries
+            series["bytes_in"] += record.bytes_in
+            series["bytes_out"] += record.bytes_out
+
+    def snapshot(self):
+        """Returns a dict from `(endpoint, method)` to the aggregates of its
+        requests, with estimated "p50" and "p99" latencies.
+        """
+        with self._lock:
+            result = collections.OrderedDict()
+            for key, series in iteritems(self._series):
+                series = dict(series, buckets=list(series["buckets"]),
+                              statuses=dict(series["statuses"]))
+                series["p50"] = self._quantile(series, 0.5)
+                series["p99"] = self._quantile(series, 0.99)
+                result[key] = series
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def report(self):
+        """Returns a plain-text table of the aggregates, slowest first."""
+        rows = [("endpoint", "method", "count", "errors", "retries",
+                 "p50 ms", "p99 ms", "KB in", "KB out")]
+        snapshot = self.snapshot()
+        for (endpoint, method), series in sorted(
+                iteritems(snapshot), key=lambda item: -item[1]["seconds"]):
+            errors = sum(count for status, count in
+                         iteritems(series["statuses"])
+                         if not 0 < status < 400)
+            rows.append((endpoint, method, str(series["count"]), str(errors),
+                         str(series["retries"]),
+                         "%.1f" % (series["p50"] * 1000),
+                         "%.1f" % (series["p99"] * 1000),
+                         "%.1f" % (series["bytes_in"] / 1024.0),
+                         "%.1f" % (series["bytes_out"] / 1024.0)))
+        widths = [max(len(row[i]) for row in rows)
+                  for i in range(len(rows[0]))]
+        return "\n".join(["  ".join(cell.ljust(width) if i < 2 else
+                                    cell.rjust(width)
+                                    for i, (cell, width) in
+                                    enumerate(zip(row, widths)))
+                          for row in rows])
+
+    def prometheus_text(self, prefix="quip"):
+        """Returns the aggregates in the Prometheus text exposition format."""
+        lines = [
+            "# HELP %s_request_duration_seconds Quip API request latency." %
+            prefix,
+            "# TYPE %s_request_duration_seconds histogram" % prefix,
+        ]
+        snapshot = self.snapshot()
+        for (endpoint, method), series in iteritems(snapshot):
+            labels = 'endpoint="%s",method="%s"' % (endpoint, method)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",),
+                                    series["buckets"]):
+                cumulative += count
+                lines.append('%s_request_duration_seconds_bucket{%s,le="%s"} '
+                             '%d' % (prefix, labels, bound, cumulative))
+            lines.append("%s_request_duration_seconds_sum{%s} %f" % (
+                prefix, labels, series["seconds"]))
+            lines.append("%s_request_duration_seconds_count{%s} %d" % (
+                prefix, labels, series["count"]))
+        for name, help, field in [
+                ("requests_total", "Quip API requests by final status.",
+                 "statuses"),
+                ("request_retries_total", "Retried Quip API requests.",
+                 "retries"),
+                ("response_bytes_total", "Bytes received from the Quip API.",
+                 "bytes_in"),
+                ("request_bytes_total", "Bytes sent to the Quip API.",
+                 "bytes_out")]:
+            lines.append("# HELP %s_%s %s" % (prefix, name, help))
+            lines.append("# TYPE %s_%s counter" % (prefix, name))
+            for (endpoint, method), series in iteritems(snapshot):
+                labels = 'endpoint="%s",method="%s"' % (endpoint, method)
+                if field == "statuses":
+                    for status, count in sorted(iteritems(series[field])):
+                        lines.append('%s_%s{%s,status="%d"} %d' % (
+                            prefix, name, labels, status, count))
+                else:
+                    lines.append("%s_%s{%s} %d" % (
+                        prefix, name, labels, series[field]))
+        return "\n".join(lines) + "\n"
+
+    def statsd_lines(self, prefix="quip"):
+        """Returns the aggregates as statsd gauge lines, e.g. for a periodic
+        flush to a statsd daemon (see also `StatsdSink`).
+        """
+        lines = []
+        for (endpoint, method), series in iteritems(self.snapshot()):
+            name = "%s.%s.%s" % (prefix, _statsd_name(endpoint), method.lower())
+            lines.extend([
+                "%s.count:%d|g" % (name, series["count"]),
+                "%s.retries:%d|g" % (name, series["retries"]),
+                "%s.bytes_in:%d|g" % (name, series["bytes_in"]),
+                "%s.bytes_out:%d|g" % (name, series["bytes_out"]),
+                "%s.p50_ms:%.3f|g" % (name, series["p50"] * 1000),
+                "%s.p99_ms:%.3f|g" % (name, series["p99"] * 1000),
+            ])
+            for status, count in sorted(iteritems(series["statuses"])):
+                lines.append("%s.status.%d:%d|g" % (name, status, count))
+        return lines
+
+    def _quantile(self, series, quantile):
+        """Estimates a latency quantile from the histogram, interpolating
+        within the bucket it falls in, like Prometheus' histogram_quantile.
+        """
+        if not series["count"]:
+            return 0.0
+        rank = quantile * series["count"]
+        cumulative = 0
+        for i, count in enumerate(series["buckets"]):
+            if count and cumulative + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (
+                    (rank - cumulative) / float(count))
+            cumulative += count
+        return self.buckets[-1]
+
+
+class StatsdSink(object):
+    """Sends every `RequestRecord` to a statsd daemon over UDP, as a timer
+    and counters named after its endpoint and method:
+
+        client = quip.QuipClient(
+            access_token=..., instrumentation=quip.StatsdSink("localhost"))
+
+    Send errors are ignored, as is usual for statsd.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8125, prefix="quip"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, record):
+        name = "%s.%s.%s" % (self.prefix, _statsd_name(record.endpoint),
+                             record.method.lower())
+        lines = [
+            "%s.duration:%.3f|ms" % (name, record.seconds * 1000),
+            "%s.status.%d:1|c" % (name, record.status),
+            "%s.bytes_in:%d|c" % (name, record.bytes_in),
+            "%s.bytes_out:%d|c" % (name, record.bytes_out),
+        ]
+        if record.retries:
+            lines.append("%s.retries:%d|c" % (name, record.retries))
+        try:
+            self._socket.sendto("\n".join(lines).encode("utf-8"),
+                                self.address)
+        except socket.error:
+            pass
+
+    def close(self):
+        self._socket.close()
+
+
+# Path segments of API endpoints, other than resource names and names with a
+# hyphen or underscore; every other segment is taken for an ID.
+_ENDPOINT_WORDS = frozenset([
+    "contacts", "current", "delete", "login", "new", "recent", "search",
+    "update"])
+
+
+def _endpoint(url):
+    """Returns the endpoint template of an API URL, e.g. "threads/{id}"."""
+    path = urlsplit(url).path
+    segments = (path[3:] if path.startswith("/1/") else path[1:]).split("/")
+    return "/".join([segments[0]] + [
+        segment if not segment or segment in _ENDPOINT_WORDS or
+        "-" in segment or "_" in segment else "{id}"
+        for segment in segments[1:]])
+
+
+def _statsd_name(endpoint):
+    name = re.sub(r"[^\w-]+", ".", endpoint.replace("{id}", "id"))
+    return name.strip(".") or "root"
+
+
+UploadProgress = collections.namedtuple(
+    "UploadProgress",
+    ["bytes_sent", "total_bytes", "seconds", "bytes_per_second"])
+
+InsertProgress = collections.namedtuple(
+    "InsertProgress",
+    ["items", "requests", "bytes_sent", "seconds", "items_per_second"])
+
+
+class _ChunkedInsert(object):
+    """The state of an insert split into several edits, shared by the
+    synchronous and asynchronous clients, which only send the requests.
+
+    Pieces inserted before a section stay in order by themselves. After
+    edits that insert after a section or at the end of the document, the
+    next edit goes after the last element inserted, which is located in
+    `document_html`: the document returned by the previous edit, or, if it
+    returned none, the one the client fetches when `needs_document` is true.
+    """
+
+    def __init__(self, client, thread_id, render, tag, progress,
+                 section_id, operation, args):
+        self.client = client
+        self.thread_id = thread_id
+        self.render = render
+        self.tag = tag
+        self.progress = progress
+        self.section_id = section_id
+        self.operation = operation
+        self.args = args
+        self.document_html = None
+        self.response = None
+        self.stats = InsertProgress(0, 0, 0, 0.0, 0.0)
+        self._inserted = 0
+        self._start = time.time()
+
+    def needs_document(self):
+        return bool(self._inserted) and not self.document_html
+
+    def edit(self, chunk):
+        """Returns the `edit_document` arguments that insert `chunk`."""
+        client = self.client
+        if self._inserted:
+            self.section_id = client._last_inserted_id(
+                self.document_html, self.tag,
+                self.section_id if self.operation != client.APPEND else None,
+                self._inserted)
+            if not self.section_id:
+                raise QuipError(
+                    409, "Could not locate the content inserted into %s; "
+                    "%d items were added" % (self.thread_id, self.stats.items),
+                    None)
+            self.operation = client.AFTER_SECTION
+        args = dict(self.args)
+        args.update(thread_id=self.thread_id,
+                    content=self.render(chunk, self.operation),
+                    section_id=self.section_id, operation=self.operation)
+        return args
+
+    def sent(self, chunk, size, response):
+        """Records the response to the edit that inserted `chunk`."""
+        self.response = response
+        self.document_html = response.get("html") \
+            if isinstance(response, dict) else None
+        if self.operation != self.client.BEFORE_SECTION:
+            self._inserted = len(chunk)
+        seconds = time.time() - self._start
+        items = self.stats.items + len(chunk)
+        self.stats = InsertProgress(
+            items, self.stats.requests + 1, self.stats.bytes_sent + size,
+            seconds, items / seconds if seconds else 0.0)
+        if self.progress is not None:
+            self.progress(self.stats)
+
+
+class _TimeCursor(object):
+    """Pages through a listing newest first by the microsecond timestamp
+    `key(item)`, down to `min_usec` if given. Shared by the synchronous and
+    asynchronous `iter_*` methods, which only fetch the pages.
+    """
+
+    def __init__(self, key, min_usec=None):
+        self.key = key
+        self.min_usec = min_usec
+
+    def sort(self, items):
+        return sorted(items, key=self.key, reverse=True)
+
+    def next_cursor(self, page):
+        oldest = self.key(page[-1])
+        if self.min_usec is not None and oldest < self.min_usec:
+            return None
+        return oldest - 1
+
+    def take(self, page):
+        """Returns the items of the page until the first one older than
+        `min_usec`.
+        """
+        if self.min_usec is None:
+            return page
+        items = []
+        for item in page:
+            if self.key(item) < self.min_usec:
+                break
+            items.append(item)
+        return items
+
+
+class MultipartEncoder(object):
+    """Streams a multipart/form-data body holding one file field.
+
+    Iterating over the encoder yields the body in chunks of `chunk_size`
+    bytes, read from `fileobj` only as they are sent, so the upload never
+    holds the whole file in memory. `len` is the total size of the body, or
+    None if the size of `fileobj` cannot be determined, in which case the
+    body is sent with chunked transfer encoding.
+
+    If given, `progress` is called with an `UploadProgress` after every
+    chunk of the file and once the body has been sent. If `fileobj` is
+    seekable, the encoder is `rewindable`: `rewind` starts the body over,
+    e.g. to send it again on another connection.
+    """
+
+    def __init__(self, field, fileobj, filename, chunk_size=64 * 1024,
+                 progress=None):
+        import uuid
+        if isinstance(fileobj, bytes):
+            fileobj = io.BytesIO(fileobj)
+        boundary = uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary=" + boundary
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.bytes_sent = 0
+        self.started = None
+        self._head = (
+            '--%s\r\nContent-Disposition: form-data; name="%s"; '
+            'filename="%s"\r\nContent-Type: application/octet-stream\r\n\r\n'
+            % (boundary, field, filename.replace('"', "%22"))).encode("utf-8")
+        self._tail = ("\r\n--%s--\r\n" % boundary).encode()
+        size = self._file_size(fileobj)
+        self.len = (None if size is None else
+                    len(self._head) + size + len(self._tail))
+        try:
+            self._start = fileobj.tell() if fileobj.seekable() else None
+        except Exception:
+            self._start = None
+        self.rewindable = self._start is not None
+
+    def rewind(self):
+        """Starts the body over, from the original position of the file."""
+        self.fileobj.seek(self._start)
+        self.bytes_sent = 0
+
+    def __iter__(self):
+        self.started = time.time()
+        yield self._send(self._head)
+        while True:
+            chunk = self.fileobj.read(self.chunk_size)
+            if not chunk:
+                break
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode("utf-8")
+            yield self._send(chunk)
+            self._report()
+        yield self._send(self._tail)
+        self._report()
+
+    def _send(self, data):
+        self.bytes_sent += len(data)
+        return data
+
+    def _report(self):
+        if self.progress is None:
+            return
+        seconds = time.time() - self.started
+        self.progress(UploadProgress(
+            self.bytes_sent, self.len, seconds,
+            self.bytes_sent / seconds if seconds else None))
+
+    def _file_size(self, fileobj):
+        import os
+        import stat
+        try:
+            status = os.fstat(fileobj.fileno())
+            if stat.S_ISREG(status.st_mode):
+                return status.st_size - fileobj.tell()
+        except Exception:
+            pass
+        try:
+            position = fileobj.tell()
+            fileobj.seek(0, 2)
+            size = fileobj.tell() - position
+            fileobj.seek(position)
+            return size
+        except Exception:
+            pass
+        headers = getattr(fileobj, "headers", None)
+        if headers is not None and headers.get("Content-Length") is not None:
+            # A response, e.g. from `QuipClient.get_blob`.
+            return int(headers.get("Content-Length"))
+        return None
+
+
+class DocumentCache(object):
+    """A thread-safe LRU cache of parsed documents (see `ParsedDocument`).
+
+    Entries are keyed by access token and thread ID, so a document is only
+    returned to callers with the token that downloaded it, and tagged with
+    the thread's `updated_usec`, so it is reused only while it is unchanged:
+
+        cache = quip.DocumentCache(max_documents=16, max_age=30)
+        client = quip.QuipClient(access_token=..., document_cache=cache)
+
+    A cached document younger than `max_age` seconds is returned without
+    downloading the thread at all; older entries are revalidated against a
+    freshly downloaded thread. `QuipClient` invalidates a thread's entry
+    after editing it. The cache holds at most `max_documents` documents and
+    evicts the least recently used ones once the total size of their
+    document HTML exceeds `max_bytes`.
+
+    Returned documents are shared, so callers must not modify them.
+    """
+
+    def __init__(self, max_documents=32, max_bytes=64 * 1024 * 1024,
+                 max_age=10):
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+
+    def get(self, thread_id, updated_usec=None, access_token=None):
+        """Returns the cached document for the given thread, or None.
+
+        If `updated_usec` is given, the entry must match it; otherwise it
+        must be younger than `max_age`.
+        """
+        key = (access_token, thread_id)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            cached_usec, document, size, stored_at = entry
+            now = time.time()
+            if updated_usec is None:
+                if now - stored_at >= self.max_age:
+                    self._entries[key] = entry
+                    return None
+            elif updated_usec == cached_usec:
+                entry = (cached_usec, document, size, now)
+            else:
+                self._bytes -= size
+                return None
+            self._entries[key] = entry
+            return document
+
+    def put(self, thread_id, updated_usec, document, size, access_token=None):
+        """Caches the document of the given thread, `size` bytes of HTML,
+        as downloaded with `access_token`.
+        """
+        key = (access_token, thread_id)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (
+                updated_usec, document, size, time.time())
+            self._bytes += size
+            while (len(self._entries) > self.max_documents or
+                   self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[2]
+
+    def invalidate(self, thread_id=None):
+        """Drops the given thread, for every access token, or every thread
+        if none is given.
+        """
+        with self._lock:
+            if thread_id is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for key in [key for key in self._entries if key[1] == thread_id]:
+                self._bytes -= self._entries.pop(key)[2]
+
+
+class ParsedDocument(object):
+    """A parsed Quip document, with its sections indexed by ID.
+
+    Every element with an ID, other than annotations, is a section.
+    `sections` lists them in document order:
+
+        document = client.parse_document(thread["html"])
+        section = document.get_section(section_id)
+        following = document.next_section(section_id)
+
+    The index is built in one pass over `tree` when the document is
+    constructed; lookups do not search the tree.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.sections = []
+        self._elements = {}
+        self._positions = {}
+        for element in tree.iter():
+            section_id = element.get("id")
+            if not section_id or section_id in self._elements:
+                continue
+            self._elements[section_id] = element
+            if element.tag != "annotation":
+                self._positions[section_id] = len(self.sections)
+                self.sections.append(element)
+
+    @property
+    def section_ids(self):
+        return [section.get("id") for section in self.sections]
+
+    def get_section(self, section_id):
+        """Returns the element with the given ID, or None."""
+        return self._elements.get(section_id)
+
+    def index(self, section_id):
+        """Returns the position of the given section in `sections`, or None.
+        """
+        return self._positions.get(section_id)
+
+    def next_section(self, section_id, offset=1):
+        """Returns the section `offset` sections after the given one, or None.
+        """
+        position = self._positions.get(section_id)
+        if position is None or not 0 <= position + offset < len(self.sections):
+            return None
+        return self.sections[position + offset]
+
+    def previous_section(self, section_id):
+        """Returns the section before the given one, or None."""
+        return self.next_section(section_id, -1)
+
+    def map_sections(self, other):
+        """Maps the section IDs of this document to the IDs of the sections
+        at the same positions in `other`, a duplicate of this document.
+        """
+        return dict(zip(self.section_ids, other.section_ids))
+
+
+class SingleFlight(object):
+    """Coalesces concurrent identical calls into one.
+
+    While a call for a key is in flight, further calls for the same key wait
+    for it and get its result (or exception) instead of calling again:
+
+        single_flight = quip.SingleFlight()
+        client = quip.QuipClient(access_token=..., single_flight=single_flight)
+
+    Callers share the returned object, so they must not modify it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        """Returns `function()`, or the result of the call in flight for the
+        same key.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    """Collects single-ID lookups into batch lookups.
+
+    `get` waits up to `window` seconds for other lookups, from any thread,
+    then resolves all of them with a single call of `fetch(ids)`, which must
+    return a dictionary keyed by ID. A batch is sent as soon as it holds
+    `max_batch_size` IDs. IDs missing from the result raise a `QuipError`
+    with code 404; if `fetch` fails, every lookup of the batch fails.
+    """
+
+    def __init__(self, fetch, window=0.005, max_batch_size=100):
+        self.fetch = fetch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+
+    def get(self, id):
+        """Returns the result of `fetch` for the given ID."""
+        from concurrent.futures import Future
+        batch = None
+        with self._lock:
+            future = self._pending.get(id)
+            if future is None:
+                future = self._pending[id] = Future()
+            if len(self._pending) >= self.max_batch_size:
+                batch = self._take_batch()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            self._resolve(batch)
+        return future.result()
+
+    def _flush(self):
+        with self._lock:
+            batch = self._take_batch()
+        if batch:
+            self._resolve(batch)
+
+    def _take_batch(self):
+        batch, self._pending = self._pending, {}
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _resolve(self, batch):
+        try:
+            results = self.fetch(list(batch))
+        except Exception as error:
+            for future in batch.values():
+                future.set_exception(error)
+            return
+        for id, future in iteritems(batch):
+            if id in results:
+                future.set_result(results[id])
+            else:
+                future.set_exception(
+                    QuipError(404, "No such ID: %s" % id, None))
+
+
+class TTLCache(object):
+    """A thread-safe cache whose entries expire `ttl` seconds after they are
+    stored, holding at most `max_entries` entries.
+
+    Used by `QuipClient` as a read-through cache of user and folder
+    metadata. Returned values are shared, so callers must not modify them.
+    """
+
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        """Returns the value for the given key, or None if it is missing or
+        expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drops the given key, or every key if none is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+class SpreadsheetIndex(object):
+    """An index over the rows of a spreadsheet for repeated lookups.
+
+    Built once from the output of `QuipClient.parse_spreadsheet_contents`,
+    it finds rows by the value of any header column, by row ID and by cell
+    ID in constant time:
+
+        client = quip.QuipClient(...)
+        index = client.index_spreadsheet(client.get_first_spreadsheet(...))
+        row = index.find_row("customer", "Acme")
+
+    The index can be passed to `update_spreadsheet_row` to skip downloading
+    and scanning the spreadsheet. Rows that `update_spreadsheet_row` adds are
+    added to the index; rebuild it after other edits of the spreadsheet.
+    """
+
+    def __init__(self, contents):
+        self.id = contents["id"]
+        self.headers = contents["headers"]
+        self.rows = contents["rows"]
+        self.rows_by_id = {}
+        self.cells_by_id = {}
+        for row in self.rows:
+            self.rows_by_id[row["id"]] = row
+            for header, cell in iteritems(row["cells"]):
+                self.cells_by_id[cell["id"]] = (row, header)
+        self._header_indexes = {}
+        self._lower_header_indexes = {}
+        for i, header in enumerate(self.headers):
+            self._header_indexes.setdefault(header, i)
+            self._lower_header_indexes.setdefault(str(header).lower(), i)
+        self._columns = {}
+
+    def header_index(self, header, default=0):
+        """Like `QuipClient.get_index_of_header`, for this spreadsheet."""
+        if header:
+            header = str(header)
+            if header in self._header_indexes:
+                return self._header_indexes[header]
+            elif header.lower() in self._lower_header_indexes:
+                return self._lower_header_indexes[header.lower()]
+            elif header.isdigit():
+                return int(header)
+            elif len(header) == 1:
+                char = ord(header.upper())
+                if ord('A') < char < ord('Z'):
+                    return char - ord('A') + 1
+        return default
+
+    def find_row(self, header, value):
+        """Returns the first row where the given header column is the given
+        value, ignoring case, or None.
+        """
+        index = self.header_index(header)
+        column = self._columns.get(index)
+        if column is None:
+            column = self._columns[index] = {}
+            if index < len(self.headers):
+                for row in self.rows:
+                    cell = row["cells"].get(self.headers[index])
+                    if cell is not None and cell["content"] is not None:
+                        column.setdefault(cell["content"].lower(), row)
+        return column.get(value.lower())
+
+    def cell_ids(self, row):
+        """Returns the ids of the cells of the given row, by header index."""
+        return [row["cells"].get(header, {}).get("id")
+                for header in self.headers]
+
+    def last_row_id(self):
+        """Returns the id of the last row."""
+        return self.rows[-1]["id"] if self.rows else None
+
+    def add_row(self, row):
+        """Adds a row, in the format of `parse_spreadsheet_contents`, after
+        the last one.
+        """
+        self.rows.append(row)
+        self.rows_by_id[row["id"]] = row
+        for header, cell in iteritems(row["cells"]):
+            self.cells_by_id[cell["id"]] = (row, header)
+        for index, column in iteritems(self._columns):
+            if index < len(self.headers):
+                cell = row["cells"].get(self.headers[index])
+                if cell is not None and cell["content"] is not None:
+                    column.setdefault(cell["content"].lower(), row)
+
+
+class _DocumentReader(object):
+    """A file-like object that reads Quip document HTML, wrapped in an
+    <html> element, as UTF-8 one piece at a time.
+    """
+
+    def __init__(self, document_html):
+        self._html = document_html
+        self._offset = None
+
+    def read(self, size=64 * 1024):
+        if self._offset is None:
+            self._offset = 0
+            return b"<html>"
+        if self._offset >= len(self._html):
+            if self._offset > len(self._html):
+                return b""
+            self._offset += 1
+            return b"</html>"
+        chunk = self._html[self._offset:self._offset + size]
+        self._offset += len(chunk)
+        return chunk.encode("utf-8")
+
+
 class QuipClient(object):
-    """A Quip API client"""
+    """A Quip API client
+
+    A client can be shared by any number of threads. Give each worker
+    thread's requests their own access token, timeout or headers with
+    `request_context`:
+
+        client = quip.QuipClient(thread_safe=True)
+
+        def handle(request):
+            with client.request_context(access_token=request.token):
+                return client.get_thread(request.thread_id)
+    """
     # Edit operations
     APPEND, \
     PREPEND, \
@@ -125,7 +1374,11 @@ class QuipClient(object):
     BLUE = range(5)
 
     def __init__(self, access_token=None, client_id=None, client_secret=None,
-                 base_url=None, request_timeout=None):
+                 base_url=None, request_timeout=None, connection_pool=None,
+                 document_cache=None, rate_limiter=None, single_flight=None,
+                 metadata_cache=None, max_batch_size=100, batch_workers=8,
+                 batch_window=None, compression=True, ssl_context=None,
+                 thread_safe=False, instrumentation=None):
         """Constructs a Quip API client.
 
         If `access_token` is given, all of the API methods in the client
@@ -134,12 +1387,163 @@ class QuipClient(object):
         Otherwise, only `get_authorization_url` and `get_access_token`
         work, and we assume the client is for a server using the Quip API's
         OAuth endpoint.
+
+        If `connection_pool` is given, requests reuse its keep-alive
+        connections (see `ConnectionPool`); otherwise every request opens a
+        new connection with `urlopen`.
+
+        If `document_cache` is given, the list and spreadsheet helpers reuse
+        its parsed documents instead of downloading and parsing a thread on
+        every call (see `DocumentCache`).
+
+        Requests are throttled and retried by `rate_limiter`, which may be
+        shared by several clients (see `RateLimiter`); by default each client
+        gets its own.
+
+        If `single_flight` is given, concurrent identical GET requests share
+        one request and its result (see `SingleFlight`). If `metadata_cache`
+        is given, users and folders are cached in it (see `TTLCache`).
+
+        `get_users`, `get_folders` and `get_threads` split their IDs into
+        requests of at most `max_batch_size` IDs, sent by up to
+        `batch_workers` threads. If `batch_window` is given, `get_user`,
+        `get_folder` and `get_thread` calls made within `batch_window`
+        seconds of each other, e.g. by different threads, in the same
+        request context are sent together as one batch request (see
+        `MicroBatcher`).
+
+        With `compression`, API responses are requested gzip- or
+        deflate-compressed. Blobs are always transferred as they are.
+
+        HTTPS connections are verified with `ssl_context` if given, and with
+        the default context otherwise. With `thread_safe`, a client without
+        a `connection_pool` uses the process-wide pool for its `ssl_context`
+        (see `shared_connection_pool`), so that all threads and clients
+        reuse the same connections.
+
+        Every request is passed as a `RequestRecord` to the `record` method
+        of `instrumentation`, or of each of a list of them (see
+        `RequestMetrics` and `StatsdSink`), and logged at debug level.
         """
+        self._local = threading.local()
         self.access_token = access_token
         self.client_id = client_id
         self.client_secret = client_secret
         self.base_url = base_url if base_url else "https://platform.quip.com"
         self.request_timeout = request_timeout if request_timeout else 10
+        self.ssl_context = ssl_context
+        if connection_pool is None and thread_safe:
+            connection_pool = shared_connection_pool(ssl_context)
+        self.connection_pool = connection_pool
+        self.document_cache = document_cache
+        self.rate_limiter = rate_limiter if rate_limiter else RateLimiter()
+        self.single_flight = single_flight
+        self.metadata_cache = metadata_cache
+        self.max_batch_size = max_batch_size
+        self.batch_workers = batch_workers
+        self.batch_window = batch_window
+        self.compression = compression
+        if instrumentation is None:
+            instrumentation = ()
+        elif not isinstance(instrumentation, (list, tuple)):
+            instrumentation = (instrumentation,)
+        self.instrumentation = tuple(instrumentation)
+        self._batchers = {}
+        self._batchers_lock = threading.Lock()
+
+    @property
+    def access_token(self):
+        context = getattr(self._local, "context", None)
+        if context and context.get("access_token"):
+            return context["access_token"]
+        return self._access_token
+
+    @access_token.setter
+    def access_token(self, access_token):
+        self._access_token = access_token
+
+    @property
+    def request_timeout(self):
+        context = getattr(self._local, "context", None)
+        if context and context.get("request_timeout"):
+            return context["request_timeout"]
+        return self._request_timeout
+
+    @request_timeout.setter
+    def request_timeout(self, request_timeout):
+        self._request_timeout = request_timeout
+
+    @contextlib.contextmanager
+    def request_context(self, access_token=None, request_timeout=None,
+                        headers=None):
+        """Within the block, requests made by the current thread use the
+        given access token, timeout and additional headers. Contexts nest,
+        and are passed on to the threads the client starts for a call, e.g.
+        for batch lookups; other threads are not affected.
+        """
+        context = {}
+        if access_token:
+            context["access_token"] = access_token
+        if request_timeout:
+            context["request_timeout"] = request_timeout
+        if headers:
+            context["headers"] = dict(self._context_value("headers") or {},
+                                      **headers)
+        with self._context(context):
+            yield self
+
+    @contextlib.contextmanager
+    def profile(self):
+        """Records the requests made within the block, including those of
+        the threads the client starts for them, in a new `RequestMetrics`:
+
+            with client.profile() as profile:
+                client.merge_comments(original_id, duplicate_ids)
+            print(profile.report())
+        """
+        metrics = RequestMetrics()
+        with self._context({"profiles": (
+                self._context_value("profiles") or ()) + (metrics,)}):
+            yield metrics
+
+    @contextlib.contextmanager
+    def _context(self, values):
+        previous = getattr(self._local, "context", None)
+        context = dict(previous or {})
+        context.update(values)
+        self._local.context = context
+        try:
+            yield
+        finally:
+            self._local.context = previous
+
+    def _context_value(self, name):
+        context = getattr(self._local, "context", None)
+        return context.get(name) if context else None
+
+    def _bind_context(self, function):
+        """Returns `function` wrapped to run in the current thread's request
+        context, from whichever thread calls it.
+        """
+        context = getattr(self._local, "context", None)
+
+        def bound(*args, **kwargs):
+            previous = getattr(self._local, "context", None)
+            self._local.context = context
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.context = previous
+        return bound
+
+    def _request_headers(self, headers):
+        headers = dict(headers or {})
+        context = getattr(self._local, "context", None)
+        if context and context.get("headers"):
+            headers.update(context["headers"])
+        if self.access_token:
+            headers["Authorization"] = "Bearer " + self.access_token
+        return headers
 
     def get_authorization_url(self, redirect_uri, state=None):
         """Returns the URL the user should be redirected to to sign in."""
@@ -163,17 +1567,20 @@ class QuipClient(object):
 
     def get_authenticated_user(self):
         """Returns the user corresponding to our access token."""
-        return self._fetch_json("users/current")
+        return self._fetch_cached_json("users/current")
 
     def get_user(self, id):
         """Returns the user with the given ID."""
-        return self._fetch_json("users/" + id)
+        if self.batch_window is not None:
+            return self._get_batched("users/", id)
+        return self._fetch_cached_json("users/" + id)
 
     def get_users(self, ids):
         """Returns a dictionary of users for the given IDs."""
-        return self._fetch_json("users/", post_data={"ids": ",".join(ids)})
+        return self._fetch_cached_batch("users/", ids)
 
     def update_user(self, user_id, picture_url=None):
+        self._invalidate_cached("users/", [user_id])
         return self._fetch_json("users/update", post_data={
             "user_id": user_id,
             "picture_url": picture_url,
@@ -185,11 +1592,13 @@ class QuipClient(object):
 
     def get_folder(self, id):
         """Returns the folder with the given ID."""
-        return self._fetch_json("folders/" + id)
+        if self.batch_window is not None:
+            return self._get_batched("folders/", id)
+        return self._fetch_cached_json("folders/" + id)
 
     def get_folders(self, ids):
         """Returns a dictionary of folders for the given IDs."""
-        return self._fetch_json("folders/", post_data={"ids": ",".join(ids)})
+        return self._fetch_cached_batch("folders/", ids)
 
     def new_folder(self, title, parent_id=None, color=None, member_ids=[]):
         return self._fetch_json("folders/new", post_data={
@@ -200,6 +1609,7 @@ class QuipClient(object):
         })
 
     def update_folder(self, folder_id, color=None, title=None):
+        self._invalidate_cached("folders/", [folder_id])
         return self._fetch_json("folders/update", post_data={
             "folder_id": folder_id,
             "color": color,
@@ -208,6 +1618,7 @@ class QuipClient(object):
 
     def add_folder_members(self, folder_id, member_ids):
         """Adds the given users to the given folder."""
+        self._invalidate_cached("folders/", [folder_id])
         return self._fetch_json("folders/add-members", post_data={
             "folder_id": folder_id,
             "member_ids": ",".join(member_ids),
@@ -215,6 +1626,7 @@ class QuipClient(object):
 
     def remove_folder_members(self, folder_id, member_ids):
         """Removes the given users from the given folder."""
+        self._invalidate_cached("folders/", [folder_id])
         return self._fetch_json("folders/remove-members", post_data={
             "folder_id": folder_id,
             "member_ids": ",".join(member_ids),
@@ -237,6 +1649,30 @@ class QuipClient(object):
             "messages/" + thread_id, max_created_usec=max_created_usec,
             count=count)
 
+    def iter_messages(self, thread_id, min_created_usec=None,
+                      max_created_usec=None, page_size=100, prefetch=True):
+        """Yields the messages of the given thread, most recent first.
+
+        Pages of `page_size` messages are requested as the iteration
+        proceeds; with `prefetch`, the next page is downloaded in the
+        background while the current one is consumed. Iteration stops at the
+        first message created before `min_created_usec`, if given.
+        """
+        cursor = self._messages_cursor(min_created_usec)
+
+        def fetch(max_created_usec):
+            return self.get_messages(
+                thread_id, max_created_usec=max_created_usec, count=page_size)
+
+        for page in self._iter_pages(
+                fetch, cursor.next_cursor, max_created_usec, prefetch):
+            for message in cursor.take(page):
+                yield message
+
+    def _messages_cursor(self, min_created_usec):
+        return _TimeCursor(lambda message: message["created_usec"],
+                           min_created_usec)
+
     def new_message(self, thread_id, content=None, **kwargs):
         """Sends a message on the given thread.
 
@@ -251,11 +1687,13 @@ class QuipClient(object):
 
     def get_thread(self, id):
         """Returns the thread with the given ID."""
+        if self.batch_window is not None:
+            return self._get_batched("threads/", id)
         return self._fetch_json("threads/" + id)
 
     def get_threads(self, ids):
         """Returns a dictionary of threads for the given IDs."""
-        return self._fetch_json("threads/", post_data={"ids": ",".join(ids)})
+        return self._fetch_batches("threads/", ids)
 
     def get_recent_threads(self, max_updated_usec=None, count=None, **kwargs):
         """Returns the recently updated threads for a given user."""
@@ -263,6 +1701,31 @@ class QuipClient(object):
             "threads/recent", max_updated_usec=max_updated_usec,
             count=count, **kwargs)
 
+    def iter_recent_threads(self, min_updated_usec=None,
+                            max_updated_usec=None, page_size=50,
+                            prefetch=True, **kwargs):
+        """Yields the recently updated threads, most recently updated first.
+
+        Like `iter_messages`, pages are requested lazily and the next page is
+        prefetched in the background. Iteration stops at the first thread
+        updated before `min_updated_usec`, if given.
+        """
+        cursor = self._recent_threads_cursor(min_updated_usec)
+
+        def fetch(max_updated_usec):
+            return cursor.sort(self.get_recent_threads(
+                max_updated_usec=max_updated_usec, count=page_size,
+                **kwargs).values())
+
+        for page in self._iter_pages(
+                fetch, cursor.next_cursor, max_updated_usec, prefetch):
+            for thread in cursor.take(page):
+                yield thread
+
+    def _recent_threads_cursor(self, min_updated_usec):
+        return _TimeCursor(lambda thread: thread["thread"]["updated_usec"],
+                           min_updated_usec)
+
     def get_matching_threads(
             self, query, count=None, only_match_titles=False, **kwargs):
         """Returns the recently updated threads for a given user."""
@@ -271,6 +1734,7 @@ class QuipClient(object):
 
     def add_thread_members(self, thread_id, member_ids):
         """Adds the given folder or user IDs to the given thread."""
+        self._invalidate_cached("folders/", member_ids)
         return self._fetch_json("threads/add-members", post_data={
             "thread_id": thread_id,
             "member_ids": ",".join(member_ids),
@@ -278,12 +1742,17 @@ class QuipClient(object):
 
     def delete_thread(self, thread_id):
         """Deletes the thread with the given thread id or secret"""
-        return self._fetch_json("threads/delete", post_data={
-            "thread_id": thread_id,
-        })
+        try:
+            return self._fetch_json("threads/delete", post_data={
+                "thread_id": thread_id,
+            })
+        finally:
+            if self.document_cache is not None:
+                self.document_cache.invalidate(thread_id)
 
     def remove_thread_members(self, thread_id, member_ids):
         """Removes the given folder or user IDs from the given thread."""
+        self._invalidate_cached("folders/", member_ids)
         return self._fetch_json("threads/remove-members", post_data={
             "thread_id": thread_id,
             "member_ids": ",".join(member_ids),
@@ -342,59 +1811,100 @@ class QuipClient(object):
         args.update(kwargs)
         return self._fetch_json("threads/copy-document", post_data=args)
 
-    def merge_comments(self, original_id, children_ids, ignore_user_ids=[]):
+    def merge_comments(self, original_id, children_ids, ignore_user_ids=[],
+                       max_workers=8):
         """Given an original document and a set of exact duplicates, copies
         all comments and messages on the duplicates to the original.
 
         Impersonates the commentors if the access token used has
         permission, but does not add them to the thread.
+
+        The messages of all duplicates are fetched concurrently, and
+        attachments are copied by a pool of `max_workers` threads while
+        earlier messages are being posted; an attachment shared by several
+        messages is copied once. Each attachment is downloaded to a spooled
+        temporary file before it is uploaded. Messages are posted in their
+        original order.
         """
-        import re
+        from concurrent.futures import ThreadPoolExecutor
         threads = self.get_threads(children_ids + [original_id])
-        original_section_ids = re.findall(r" id='([a-zA-Z0-9]{11})'",
-                                          threads[original_id]["html"])
-        for thread_id in children_ids:
-            thread = threads[thread_id]
-            child_section_ids = re.findall(r" id='([a-zA-Z0-9]{11})'",
-                                           thread["html"])
-            parent_map = dict(zip(child_section_ids, original_section_ids))
-            messages = self.get_messages(thread_id)
-            for message in reversed(messages):
-                if message["author_id"] in ignore_user_ids:
-                    continue
-                kwargs = {
-                    "user_id": message["author_id"],
-                    "frame": "bubble",
-                    "service_id": message["id"],
-                }
-                if "parts" in message:
-                    kwargs["parts"] = json.dumps(message["parts"])
-                else:
-                    kwargs["content"] = message["text"]
-                if "annotation" in message:
-                    section_id = None
-                    if "highlight_section_ids" in message["annotation"]:
-                        section_id = message["annotation"][
-                            "highlight_section_ids"][0]
+        original = self.parse_document(threads[original_id]["html"])
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            message_futures = [
+                executor.submit(self._bind_context(self.get_messages),
+                                thread_id) for thread_id in children_ids]
+            blob_futures = {}
+            pending = []
+            for thread_id, messages in zip(children_ids, message_futures):
+                thread = threads[thread_id]
+                parent_map = self.parse_document(
+                    thread["html"]).map_sections(original)
+                annotation_sections = self._get_annotation_sections(
+                    thread["html"])
+                for message in reversed(messages.result()):
+                    if message["author_id"] in ignore_user_ids:
+                        continue
+                    kwargs = {
+                        "user_id": message["author_id"],
+                        "frame": "bubble",
+                        "service_id": message["id"],
+                    }
+                    if "parts" in message:
+                        kwargs["parts"] = json.dumps(message["parts"])
                     else:
-                        anno_loc = thread["html"].find(
-                            '<annotation id="%s"' % message["annotation"]["id"])
-                        loc = thread["html"].rfind("id=", 0, anno_loc)
-                        if anno_loc >= 0 and loc >= 0:
-                            section_id = thread["html"][loc + 4:loc + 15]
-                    if section_id and section_id in parent_map:
-                        kwargs["section_id"] = parent_map[section_id]
-                if "files" in message:
+                        kwargs["content"] = message["text"]
+                    if "annotation" in message:
+                        section_id = None
+                        if "highlight_section_ids" in message["annotation"]:
+                            section_id = message["annotation"][
+                                "highlight_section_ids"][0]
+                        else:
+                            section_id = annotation_sections.get(
+                                message["annotation"]["id"])
+                        if section_id and section_id in parent_map:
+                            kwargs["section_id"] = parent_map[section_id]
                     attachments = []
-                    for blob_info in message["files"]:
-                        blob = self.get_blob(thread_id, blob_info["hash"])
-                        new_blob = self.put_blob(
-                            original_id, blob, name=blob_info["name"])
-                        attachments.append(new_blob["id"])
-                    if attachments:
-                        kwargs["attachments"] = ",".join(attachments)
+                    for blob_info in message.get("files", []):
+                        if blob_info["hash"] not in blob_futures:
+                            blob_futures[blob_info["hash"]] = executor.submit(
+                                self._bind_context(self._copy_blob), thread_id,
+                                blob_info["hash"], original_id,
+                                blob_info["name"])
+                        attachments.append(blob_futures[blob_info["hash"]])
+                    pending.append((kwargs, attachments))
+            for kwargs, attachments in pending:
+                if attachments:
+                    kwargs["attachments"] = ",".join(
+                        [future.result() for future in attachments])
                 self.new_message(original_id, **kwargs)
 
+    def _copy_blob(self, thread_id, blob_id, destination_thread_id, name):
+        # The blob is spooled, so that the download's connection goes back to
+        # the pool before the upload needs one: workers that held one while
+        # waiting for another could exhaust the pool.
+        import tempfile
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as blob:
+            self.download_blob(thread_id, blob_id, writer=blob)
+            blob.seek(0)
+            return self.put_blob(destination_thread_id, blob, name=name)["id"]
+
+    def _get_annotation_sections(self, document_html):
+        """Maps the annotation IDs in the given document HTML to the ID of
+        the section preceding each annotation, in a single pass.
+        """
+        sections = {}
+        last_id = -1
+        for match in re.finditer(r'<annotation id="([^"]*)"|id=',
+                                 document_html):
+            if match.group(1) is None:
+                last_id = match.start()
+                continue
+            if last_id >= 0 and match.group(1) not in sections:
+                sections[match.group(1)] = document_html[
+                    last_id + 4:last_id + 15]
+            last_id = match.start() + len("<annotation ")
+        return sections
+
     def edit_document(self, thread_id, content, operation=APPEND, format="html",
                       section_id=None, **kwargs):
         """Edits the given document, adding the given content.
@@ -417,7 +1927,95 @@ class QuipClient(object):
             "section_id": section_id
         }
         args.update(kwargs)
-        return self._fetch_json("threads/edit-document", post_data=args)
+        try:
+            return self._fetch_json("threads/edit-document", post_data=args)
+        finally:
+            if self.document_cache is not None:
+                self.document_cache.invalidate(thread_id)
+
+    def sync_document(self, thread_id, content, document_html=None):
+        """Edits the given document so that its sections match the given HTML,
+        leaving unchanged sections untouched.
+
+        The top-level sections of the document and of `content` are compared
+        by a hash of their HTML without section IDs, and only the runs that
+        differ are edited: new sections are inserted with one edit per run,
+        a changed run is replaced with one edit (plus a delete for every
+        further section it had), and removed sections are deleted. If the
+        current `document_html` is not given, the thread is downloaded.
+        Text outside the top-level sections of `content` has no section to
+        go in, so it raises a `ValueError`.
+
+        Returns the number of sections left "unchanged", "written" and
+        "removed", and the number of "edits" made.
+        """
+        if document_html is None:
+            document_html = self.get_thread(thread_id).get("html") or ""
+        edits, result = self._plan_sync(document_html, content)
+        for html, operation, section_id in edits:
+            self.edit_document(thread_id, html, operation,
+                               section_id=section_id)
+        return result
+
+    def _plan_sync(self, document_html, content):
+        """Returns the edits, as (content, operation, section ID) tuples, that
+        make the given document match `content`, and the counts that
+        `sync_document` returns for them.
+        """
+        import difflib
+        current = list(self.parse_document_html(document_html)) \
+            if document_html else []
+        root = self.parse_document_html(content)
+        for text in [root.text] + [section.tail for section in root]:
+            if text and text.strip():
+                raise ValueError(
+                    "Text outside of a section: %r" % text.strip()[:50])
+        desired = [self._strip_section_ids(section) for section in root]
+        matcher = difflib.SequenceMatcher(
+            None, [self._section_hash(self._strip_section_ids(section))
+                   for section in current],
+            [self._section_hash(section) for section in desired],
+            autojunk=False)
+        edits = []
+        result = {"unchanged": 0, "written": 0, "removed": 0, "edits": 0}
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                result["unchanged"] += i2 - i1
+                continue
+            section_ids = [section.get("id") for section in current[i1:i2]]
+            html = "".join([xml.etree.cElementTree.tostring(section).decode(
+                "utf-8") for section in desired[j1:j2]])
+            if tag == "insert" and i1 < len(current):
+                edits.append(
+                    (html, self.BEFORE_SECTION, current[i1].get("id")))
+            elif tag == "insert":
+                edits.append((html, self.APPEND, None))
+            elif tag == "replace":
+                edits.append(
+                    (html, self.REPLACE_SECTION, section_ids.pop(0)))
+            edits.extend([("", self.DELETE_SECTION, section_id)
+                          for section_id in section_ids])
+            result["written"] += j2 - j1
+            result["removed"] += i2 - i1
+            result["edits"] += (tag != "delete") + len(section_ids)
+        return edits, result
+
+    def _strip_section_ids(self, section):
+        """Returns a copy of the given element without IDs. Whitespace tail
+        text is dropped too; other tail text is kept, so that it is part of
+        the comparison.
+        """
+        import copy
+        section = copy.deepcopy(section)
+        if section.tail and not section.tail.strip():
+            section.tail = None
+        for element in section.iter():
+            element.attrib.pop("id", None)
+        return section
+
+    def _section_hash(self, section):
+        import hashlib
+        return hashlib.sha1(xml.etree.cElementTree.tostring(section)).digest()
 
     def add_to_first_list(self, thread_id, *items, **kwargs):
         """Adds the given items to the first list in the given document.
@@ -425,24 +2023,55 @@ class QuipClient(object):
             client = quip.QuipClient(...)
             client.add_to_first_list(thread_id, "Try the Quip API")
 
+        Many items are added with several edits (see `bulk_add_to_first_list`).
+        """
+        return self._add_to_list(thread_id, items, **kwargs)[0]
+
+    def bulk_add_to_first_list(self, thread_id, items, max_bytes=256 * 1024,
+                               progress=None, **kwargs):
+        """Adds the items of the given iterable to the first list in the given
+        document, in order, with as many edits as it takes to keep each under
+        `max_bytes` of content. Returns an `InsertProgress`.
+
+        Items are read as they are sent, so `items` can be a generator. If
+        given, `progress` is called with an `InsertProgress` after every edit.
+        """
+        return self._add_to_list(
+            thread_id, items, max_bytes=max_bytes, progress=progress,
+            **kwargs)[1]
+
+    def _add_to_list(self, thread_id, items, max_bytes=256 * 1024,
+                     progress=None, **kwargs):
+        first_list = None
+        if "section_id" not in kwargs:
+            first_list = self.get_first_list(
+                thread_id, kwargs.pop("document_html", None))
+        pieces, render, args = self._plan_list_insert(
+            items, first_list, kwargs)
+        return self._insert_in_chunks(
+            thread_id, pieces, render, "li", max_bytes, progress, **args)
+
+    def _plan_list_insert(self, items, first_list, kwargs):
+        """Returns the pieces, `render` function and edit arguments that add
+        `items` after the last item of `first_list`, or at the end of the
+        document if there is no list.
         """
-        items = [item.replace("\n", " ") for item in items]
         args = {
-            "thread_id": thread_id,
-            "content": "\n\n".join(items),
             "format": "markdown",
             "operation": self.AFTER_SECTION
         }
         args.update(kwargs)
-        if "section_id" not in args:
-            first_list = self.get_first_list(
-                thread_id, kwargs.pop("document_html", None))
-            if first_list:
-                args["section_id"] = self.get_last_list_item_id(first_list)
+        if first_list:
+            args["section_id"] = self.get_last_list_item_id(first_list)
         if not args.get("section_id"):
             args["operation"] = self.APPEND
-            args["content"] = "\n\n".join(["    * %s" % i for i in items])
-        return self.edit_document(**args)
+
+        def render(items, operation):
+            if operation == self.APPEND:
+                return "\n\n".join(["    * %s" % i for i in items])
+            return "\n\n".join(items)
+
+        return (item.replace("\n", " ") for item in items), render, args
 
     def add_to_spreadsheet(self, thread_id, *rows, **kwargs):
         """Adds the given rows to the named (or first) spreadsheet in the
@@ -451,26 +2080,117 @@ class QuipClient(object):
             client = quip.QuipClient(...)
             client.add_to_spreadsheet(thread_id, ["5/1/2014", 2.24])
 
+        Many rows are added with several edits (see `bulk_add_to_spreadsheet`).
+        """
+        return self._add_to_spreadsheet(thread_id, rows, **kwargs)[0]
+
+    def bulk_add_to_spreadsheet(self, thread_id, rows, name=None,
+                                add_to_top=False, max_bytes=256 * 1024,
+                                progress=None):
+        """Adds the rows of the given iterable to the named (or first)
+        spreadsheet in the given document, in order, with as many edits as it
+        takes to keep each under `max_bytes` of content. Returns an
+        `InsertProgress`.
+
+            client.bulk_add_to_spreadsheet(
+                thread_id, ([day, total] for day, total in read_totals()))
+
+        Rows are read as they are sent, so `rows` can be a generator. If
+        given, `progress` is called with an `InsertProgress` after every edit.
         """
-        content = "".join(["<tr>%s</tr>" % "".join(
-            ["<td>%s</td>" % cell for cell in row]) for row in rows])
-        if kwargs.get("name"):
-            spreadsheet = self.get_named_spreadsheet(kwargs["name"], thread_id)
+        return self._add_to_spreadsheet(
+            thread_id, rows, name=name, add_to_top=add_to_top,
+            max_bytes=max_bytes, progress=progress)[1]
+
+    def _add_to_spreadsheet(self, thread_id, rows, name=None, add_to_top=False,
+                            max_bytes=256 * 1024, progress=None):
+        if name:
+            spreadsheet = self.get_named_spreadsheet(name, thread_id)
         else:
             spreadsheet = self.get_first_spreadsheet(thread_id)
-        if kwargs.get("add_to_top"):
+        pieces, render, args = self._plan_spreadsheet_insert(
+            rows, spreadsheet, add_to_top)
+        return self._insert_in_chunks(
+            thread_id, pieces, render, "tr", max_bytes, progress, **args)
+
+    def _plan_spreadsheet_insert(self, rows, spreadsheet, add_to_top):
+        """Like `_plan_list_insert`, for rows added to the top or bottom of
+        the given spreadsheet.
+        """
+        if add_to_top:
             section_id = self.get_first_row_item_id(spreadsheet)
             operation = self.BEFORE_SECTION
         else:
             section_id = self.get_last_row_item_id(spreadsheet)
             operation = self.AFTER_SECTION
-        return self.edit_document(
-            thread_id=thread_id,
-            content=content,
-            section_id=section_id,
-            operation=operation)
-
-    def update_spreadsheet_row(self, thread_id, header, value, updates, **args):
+        pieces = ("<tr>%s</tr>" % "".join(
+            ["<td>%s</td>" % cell for cell in row]) for row in rows)
+        return pieces, lambda rows, operation: "".join(rows), {
+            "section_id": section_id, "operation": operation}
+
+    def _insert_in_chunks(self, thread_id, pieces, render, tag, max_bytes,
+                          progress, section_id=None, operation=APPEND,
+                          **args):
+        """Inserts the given pieces of content, each of which becomes one `tag`
+        element, with as few edits of at most `max_bytes` as possible.
+        `render` joins the pieces of an edit for the operation used (see
+        `_ChunkedInsert`). Returns the last response and an `InsertProgress`.
+        """
+        insert = _ChunkedInsert(self, thread_id, render, tag, progress,
+                                section_id, operation, args)
+        for chunk, size in self._chunk_pieces(pieces, max_bytes):
+            if insert.needs_document():
+                insert.document_html = self.get_thread(thread_id).get("html")
+            insert.sent(chunk, size, self.edit_document(**insert.edit(chunk)))
+        return insert.response, insert.stats
+
+    def _chunk_pieces(self, pieces, max_bytes):
+        """Groups the given strings into lists of at most `max_bytes` of
+        UTF-8, yielding each list and its size. Larger strings get a list
+        of their own.
+        """
+        chunk = []
+        size = 0
+        for piece in pieces:
+            piece_size = len(piece.encode("utf-8"))
+            if chunk and size + piece_size > max_bytes:
+                yield chunk, size
+                chunk = []
+                size = 0
+            chunk.append(piece)
+            size += piece_size
+        if chunk:
+            yield chunk, size
+
+    def _last_inserted_id(self, document_html, tag, section_id, count):
+        """Returns the ID of the last of `count` `tag` elements inserted after
+        the given section, or of the last `tag` element of the document if no
+        section is given.
+        """
+        element = self._last_inserted_element(
+            document_html, tag, section_id, count)
+        return element.get("id") if element is not None else None
+
+    def _last_inserted_element(self, document_html, tag, section_id, count):
+        """Like `_last_inserted_id`, but returns the element."""
+        if section_id is None:
+            return self.find_document_element(
+                document_html, lambda element: element.tag == tag, -1)
+        state = {"found": False, "count": count}
+
+        def match(element):
+            if not state["found"]:
+                state["found"] = element.get("id") == section_id
+                return False
+            if element.tag != tag:
+                return False
+            state["count"] -= 1
+            return not state["count"]
+
+        return self.find_document_element(document_html, match)
+
+    def update_spreadsheet_row(self, thread_id, header, value, updates,
+                               spreadsheet_index=None, **args):
         """Finds the row where the given header column is the given value, and
         applies the given updates. Updates is a dict from header to
         new value. In both cases headers can either be a string that matches, or
@@ -480,7 +2200,12 @@ class QuipClient(object):
             client.update_spreadsheet_row(
                 thread_id, "customer", "Acme", {"Billed": "6/24/2015"})
 
+        If a `SpreadsheetIndex` of the spreadsheet is given, the row is looked
+        up in it instead of downloading the spreadsheet.
         """
+        if spreadsheet_index is not None:
+            return self._update_indexed_spreadsheet_row(
+                thread_id, header, value, updates, spreadsheet_index, **args)
         response = None
         if args.get("name"):
             spreadsheet = self.get_named_spreadsheet(args["name"], thread_id)
@@ -507,10 +2232,204 @@ class QuipClient(object):
                 thread_id, spreadsheet, updates, headers=headers, **args)
         return response
 
+    def _update_indexed_spreadsheet_row(self, thread_id, header, value,
+                                        updates, spreadsheet_index, **args):
+        last_row_id = spreadsheet_index.last_row_id()
+        edits, added = self._plan_indexed_row(
+            header, value, updates, spreadsheet_index)
+        response = None
+        for edit in edits:
+            edit.update(args)
+            response = self.edit_document(thread_id=thread_id, **edit)
+        if added:
+            html = response.get("html") if isinstance(response, dict) \
+                else None
+            self._index_added_row(
+                spreadsheet_index, html or self.get_thread(thread_id).get(
+                    "html"), last_row_id)
+        return response
+
+    def _plan_indexed_row(self, header, value, updates, spreadsheet_index):
+        """Returns the edits, as `edit_document` arguments, that apply the
+        given updates to the row found in the `SpreadsheetIndex`, and whether
+        they add the row because it was not found.
+        """
+        row = spreadsheet_index.find_row(header, value)
+        if not row:
+            updates[header] = value
+            return [{
+                "content": self._spreadsheet_row_html(
+                    spreadsheet_index.headers, updates),
+                "section_id": spreadsheet_index.last_row_id(),
+                "operation": self.AFTER_SECTION,
+            }], True
+        ids = spreadsheet_index.cell_ids(row)
+        edits = []
+        for head, val in iteritems(updates):
+            index = spreadsheet_index.header_index(head)
+            if not index or index >= len(ids) or not ids[index]:
+                continue
+            edits.append({
+                "content": val,
+                "format": "markdown",
+                "section_id": ids[index],
+                "operation": self.REPLACE_SECTION,
+            })
+        return edits, False
+
+    def _index_added_row(self, spreadsheet_index, document_html, last_row_id):
+        """Adds the row inserted after `last_row_id` in the given document to
+        the index, so that the next row is added after it.
+        """
+        element = self._last_inserted_element(
+            document_html, "tr", last_row_id, 1)
+        if element is not None:
+            row = self._parse_spreadsheet_row(
+                element, spreadsheet_index.headers)
+            if row:
+                spreadsheet_index.add_row(row)
+
+    def update_spreadsheet_rows(self, thread_id, header, rows, **args):
+        """Like `update_spreadsheet_row`, but applies the updates of many rows
+        with as few edits as possible.
+
+        `rows` is a dict, or an iterable of pairs, from a value of the given
+        header column to the updates of that row. Values are plain text,
+        which is escaped. Each matched row is rewritten with a single edit
+        (or a single cell edit if only one of its cells changes), and all
+        rows that are not found are added with one edit. Returns the response
+        of the edit that applied each row, in the order of `rows`, with None
+        for rows that needed no edit.
+
+            client = quip.QuipClient(...)
+            client.update_spreadsheet_rows(thread_id, "customer", {
+                "Acme": {"Billed": "6/24/2015", "Paid": "Yes"},
+                "Initech": {"Billed": "6/25/2015"},
+            })
+
+        """
+        if isinstance(rows, dict):
+            rows = iteritems(rows)
+        rows = list(rows)
+        if args.get("name"):
+            spreadsheet = self.get_named_spreadsheet(args["name"], thread_id)
+        else:
+            spreadsheet = self.get_first_spreadsheet(thread_id)
+        results = [None] * len(rows)
+        for edit, positions in self._plan_spreadsheet_rows(
+                spreadsheet, header, rows):
+            edit.update(args)
+            response = self.edit_document(thread_id=thread_id, **edit)
+            for position in positions:
+                results[position] = response
+        return results
+
+    def _plan_spreadsheet_rows(self, spreadsheet, header, rows):
+        """Returns the edits, as `edit_document` arguments, that apply the
+        given (value, updates) pairs to the spreadsheet, each with the
+        positions of the pairs it applies.
+        """
+        headers = self.get_spreadsheet_header_items(spreadsheet)
+        header_index = self.get_index_of_header(headers, header)
+        existing = {}
+        for row in spreadsheet.iterfind(".//tr"):
+            if len(row) <= header_index or row[header_index].tag != "td":
+                continue
+            text = (list(row[header_index].itertext()) or [""])[0]
+            existing.setdefault(text.lower(), row)
+
+        # Merge the updates addressed to the same row, so that every row is
+        # edited only once.
+        merged = collections.OrderedDict()
+        for position, (value, updates) in enumerate(rows):
+            row = existing.get(value.lower())
+            key = row.attrib.get("id") if row is not None else value.lower()
+            if key not in merged:
+                merged[key] = (row, value, {}, [])
+            merged[key][2].update(updates)
+            merged[key][3].append(position)
+
+        edits = []
+        new_rows = []
+        for row, value, updates, positions in merged.values():
+            if row is None:
+                updates[header] = value
+                new_rows.append((self._spreadsheet_row_html(
+                    headers, updates, escape=True), positions))
+                continue
+            edit = self._replace_spreadsheet_row(headers, row, updates)
+            if edit is not None:
+                edits.append((edit, positions))
+        if new_rows:
+            edits.append(({
+                "content": "".join([content for content, _ in new_rows]),
+                "section_id": self.get_last_row_item_id(spreadsheet),
+                "operation": self.AFTER_SECTION,
+            }, [position for _, positions in new_rows
+                for position in positions]))
+        return edits
+
+    def _replace_spreadsheet_row(self, headers, row, updates):
+        """Returns the edit that applies the given plain text updates to the
+        row, or None if none of its cells change.
+        """
+        ids = self.get_row_ids(row)
+        changes = {}
+        for head, val in iteritems(updates):
+            index = self.get_index_of_header(headers, head)
+            if not index or index >= len(ids) or not ids[index]:
+                continue
+            changes[index] = val
+        if not changes:
+            return None
+        if len(changes) == 1:
+            index, val = changes.popitem()
+            return {
+                "content": self._escape_text(val),
+                "section_id": ids[index],
+                "operation": self.REPLACE_SECTION,
+            }
+        cells = []
+        for index, cell in enumerate(row):
+            if index in changes:
+                cells.append(self._cell_html(changes[index]))
+                continue
+            # Keep unchanged cells as they are, minus the ids of the old row.
+            kept = xml.etree.cElementTree.Element(cell.tag, dict(
+                (k, v) for k, v in iteritems(cell.attrib) if k != "id"))
+            kept.text = cell.text
+            kept.extend(list(cell))
+            cells.append(
+                xml.etree.cElementTree.tostring(kept).decode("utf-8"))
+        return {
+            "content": "<tr>%s</tr>" % "".join(cells),
+            "section_id": row.attrib["id"],
+            "operation": self.REPLACE_SECTION,
+        }
+
+    def _cell_html(self, value):
+        """Returns a spreadsheet cell with the given plain text."""
+        return "<td>%s</td>" % self._escape_text(value)
+
+    def _escape_text(self, value):
+        import xml.sax.saxutils
+        return xml.sax.saxutils.escape(u"%s" % value)
+
     def add_spreadsheet_row(
             self, thread_id, spreadsheet, updates, headers=None, **args):
         if not headers:
             headers = self.get_spreadsheet_header_items(spreadsheet)
+        content = self._spreadsheet_row_html(headers, updates)
+        section_id = self.get_last_row_item_id(spreadsheet)
+        response = self.edit_document(
+            thread_id=thread_id,
+            content=content,
+            section_id=section_id,
+            operation=self.AFTER_SECTION,
+            **args)
+        return response
+
+    def _spreadsheet_row_html(self, headers, updates, escape=False):
         indexed_items = {}
         extra_items = []
         for head, val in iteritems(updates):
@@ -530,16 +2449,11 @@ class QuipClient(object):
                 else:
                     cells.append("")
         cells.extend(extra_items)
-        content = "<tr>%s</tr>" % "".join(
+        if escape:
+            return "<tr>%s</tr>" % "".join(
+                [self._cell_html(cell) for cell in cells])
+        return "<tr>%s</tr>" % "".join(
             ["<td>%s</td>" % cell for cell in cells])
-        section_id = self.get_last_row_item_id(spreadsheet)
-        response = self.edit_document(
-            thread_id=thread_id,
-            content=content,
-            section_id=section_id,
-            operation=self.AFTER_SECTION,
-            **args)
-        return response
 
     def toggle_checkmark(self, thread_id, item, checked=True):
         """Sets the checked state of the given list item to the given state.
@@ -573,40 +2487,63 @@ class QuipClient(object):
         return self._get_container(thread_id, document_html, "ul", -1)
 
     def get_section(self, section_id, thread_id=None, document_html=None):
-        if not document_html:
-            document_html = self.get_thread(thread_id).get("html")
-            if not document_html:
-                return None
-        tree = self.parse_document_html(document_html)
-        element = list(tree.iterfind(".//*[@id='%s']" % section_id))
-        if not element:
-            return None
-        return element[0]
+        if not document_html and self.document_cache is not None:
+            document = self._get_parsed_document(thread_id)
+            return document.get_section(section_id) if document else None
+        return self._find_in_document(
+            thread_id, document_html,
+            lambda element: element.get("id") == section_id)
 
     def get_named_spreadsheet(self, name, thread_id=None, document_html=None):
-        if not document_html:
-            document_html = self.get_thread(thread_id).get("html")
-            if not document_html:
-                return None
-        tree = self.parse_document_html(document_html)
-        element = list(tree.iterfind(".//*[@title='%s']" % name))
-        if not element:
-            return None
-        return element[0]
+        return self._find_in_document(
+            thread_id, document_html,
+            lambda element: element.get("title") == name)
 
     def _get_container(self, thread_id, document_html, container, index):
+        return self._find_in_document(
+            thread_id, document_html,
+            lambda element: element.tag == container, index)
+
+    def _find_in_document(self, thread_id, document_html, match, index=0):
+        """Returns the `index`th element of the document (-1 for the last)
+        for which `match` returns True, or None.
+
+        Documents are parsed incrementally (see `find_document_element`),
+        unless a parsed document can be shared through the `document_cache`.
+        """
+        if not document_html and self.document_cache is not None:
+            document = self._get_parsed_document(thread_id)
+            if document is None:
+                return None
+            elements = [element for element in document.tree.iter()
+                        if match(element)]
+            try:
+                return elements[index]
+            except IndexError:
+                return None
         if not document_html:
             document_html = self.get_thread(thread_id).get("html")
             if not document_html:
                 return None
-        tree = self.parse_document_html(document_html)
-        lists = list(tree.iter(container))
-        if not lists:
-            return None
-        try:
-            return lists[index]
-        except IndexError:
+        return self.find_document_element(document_html, match, index)
+
+    def _get_parsed_document(self, thread_id):
+        cache = self.document_cache
+        access_token = self.access_token
+        document = cache.get(thread_id, access_token=access_token)
+        if document is not None:
+            return document
+        thread = self.get_thread(thread_id)
+        document_html = thread.get("html")
+        if not document_html:
             return None
+        updated_usec = thread.get("thread", {}).get("updated_usec")
+        document = cache.get(thread_id, updated_usec, access_token)
+        if document is None:
+            document = self.parse_document(document_html)
+            cache.put(thread_id, updated_usec, document, len(document_html),
+                      access_token)
+        return document
 
     def get_last_list_item_id(self, list_tree):
         """Returns the last item in the given list `ElementTree`."""
@@ -688,64 +2625,199 @@ class QuipClient(object):
             if list(cell.itertext())[0].lower() == value.lower():
                 return row
 
+    def index_spreadsheet(self, spreadsheet_tree):
+        """Returns a `SpreadsheetIndex` of the given spreadsheet `ElementTree`.
+        """
+        return SpreadsheetIndex(
+            self.parse_spreadsheet_contents(spreadsheet_tree))
+
     def parse_spreadsheet_contents(self, spreadsheet_tree):
         """Returns a python-friendly representation of the given spreadsheet
         `ElementTree`
         """
-        import collections
         spreadsheet = {
             "id": spreadsheet_tree.attrib.get("id"),
             "headers": self.get_spreadsheet_header_items(spreadsheet_tree),
             "rows": [],
         }
         for row in spreadsheet_tree.iterfind(".//tr"):
-            value = {
-                "id": row.attrib.get("id"),
-                "cells": collections.OrderedDict(),
+            value = self._parse_spreadsheet_row(row, spreadsheet["headers"])
+            if value:
+                spreadsheet["rows"].append(value)
+        return spreadsheet
+
+    def _parse_spreadsheet_row(self, row, headers):
+        """Returns the given row `ElementTree` in the format of
+        `parse_spreadsheet_contents`, or None if it has no cells.
+        """
+        value = {
+            "id": row.attrib.get("id"),
+            "cells": collections.OrderedDict(),
+        }
+        for i, cell in enumerate(row):
+            if cell.tag != "td":
+                continue
+            data = {
+                "id": cell.attrib.get("id"),
             }
+            images = list(cell.iter("img"))
+            if images:
+                data["content"] = images[0].attrib.get("src")
+            else:
+                data["content"] = (list(cell.itertext()) or [""])[0].replace(
+                    u"\u200b", "")
+            style = cell.attrib.get("style")
+            if style and "background-color:#" in style:
+                sharp = style.find("#")
+                data["color"] = style[sharp + 1:sharp + 7]
+            value["cells"][headers[i]] = data
+        return value if len(value["cells"]) else None
+
+    def parse_spreadsheet_columns(self, spreadsheet_tree, types=None,
+                                  output=None):
+        """Returns the given spreadsheet `ElementTree` as columns: a dict with
+        the spreadsheet "id", its "headers", the "row_ids" and the "columns",
+        an `OrderedDict` from each header to the list of its cell contents.
+
+        Rows and cells are read as `parse_spreadsheet_contents` reads them,
+        in a single pass over the rows; missing cells are None. `types` maps
+        headers to a type or function that each non-empty value of the
+        column is converted with; empty values and values that cannot be
+        converted become None.
+
+        With `output="numpy"` the columns are NumPy arrays (None becomes NaN
+        in float columns), and with `output="pandas"` a `DataFrame` indexed
+        by row ID is returned instead. These require the 'numpy' and 'pandas'
+        modules.
+        """
+        headers = None
+        columns = []
+        row_ids = []
+        for row in spreadsheet_tree.iter("tr"):
+            if headers is None:
+                headers = self.get_row_items(row)
+                columns = [[] for _ in headers]
+            values = [None] * len(headers)
+            has_cells = False
             for i, cell in enumerate(row):
-                if cell.tag != "td":
+                if cell.tag != "td" or i >= len(headers):
                     continue
-                data = {
-                    "id": cell.attrib.get("id"),
-                }
-                images = list(cell.iter("img"))
-                if images:
-                    data["content"] = images[0].attrib.get("src")
+                has_cells = True
+                image = next(cell.iter("img"), None)
+                if image is not None:
+                    values[i] = image.get("src")
                 else:
-                    data["content"] = list(cell.itertext())[0].replace(
+                    values[i] = next(cell.itertext(), "").replace(
                         u"\u200b", "")
-                style = cell.attrib.get("style")
-                if style and "background-color:#" in style:
-                    sharp = style.find("#")
-                    data["color"] = style[sharp + 1:sharp + 7]
-                value["cells"][spreadsheet["headers"][i]] = data
-            if len(value["cells"]):
-                spreadsheet["rows"].append(value)
-        return spreadsheet
+            if has_cells:
+                row_ids.append(row.get("id"))
+                for column, value in zip(columns, values):
+                    column.append(value)
+        headers = headers or []
+        for i, header in enumerate(headers):
+            convert = (types or {}).get(header)
+            if convert is not None:
+                columns[i] = [self._convert_cell(value, convert)
+                              for value in columns[i]]
+        if output in ("numpy", "pandas"):
+            import numpy
+            columns = [
+                numpy.array([numpy.nan if value is None else value
+                             for value in column], dtype=float)
+                if (types or {}).get(header) in (float, int) else
+                numpy.array(column, dtype=object)
+                for header, column in zip(headers, columns)]
+        if output == "pandas":
+            import pandas
+            return pandas.DataFrame(
+                collections.OrderedDict(zip(headers, columns)),
+                index=pandas.Index(row_ids, name="id"), columns=headers)
+        return {
+            "id": spreadsheet_tree.attrib.get("id"),
+            "headers": headers,
+            "row_ids": row_ids,
+            "columns": collections.OrderedDict(zip(headers, columns)),
+        }
+
+    def _convert_cell(self, value, convert):
+        if value is None or not value.strip():
+            return None
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            return None
 
     def parse_document_html(self, document_html):
         """Returns an `ElementTree` for the given Quip document HTML"""
         document_xml = "<html>" + document_html + "</html>"
         return xml.etree.cElementTree.fromstring(document_xml.encode("utf-8"))
 
+    def parse_document(self, document_html):
+        """Returns a `ParsedDocument` for the given Quip document HTML"""
+        return ParsedDocument(self.parse_document_html(document_html))
+
+    def iterparse_document_html(self, document_html, events=("end",)):
+        """Parses the given Quip document HTML incrementally, yielding
+        `(event, element)` pairs like `ElementTree.iterparse`.
+
+        The HTML is encoded and fed to the parser a piece at a time, so no
+        other copy of the document is made. Consumers can stop at any point,
+        and can discard the elements they are done with.
+        """
+        return xml.etree.cElementTree.iterparse(
+            _DocumentReader(document_html), events)
+
+    def find_document_element(self, document_html, match, index=0):
+        """Returns the `index`th element (-1 for the last) in the given Quip
+        document HTML for which `match` returns True, or None.
+
+        Elements are counted in document order, like `ElementTree.iter`.
+        The parse stops as soon as the element is complete, and every other
+        subtree is discarded once parsed, so memory use stays proportional
+        to the element rather than to the document.
+        """
+        found = None
+        count = 0
+        stack = []
+        for event, element in self.iterparse_document_html(
+                document_html, ("start", "end")):
+            if event == "start":
+                if stack and match(element):
+                    if index < 0 or count == index:
+                        found = element
+                    count += 1
+                stack.append(element)
+                continue
+            stack.pop()
+            if element is found and index >= 0:
+                return found
+            if stack and found not in stack:
+                # Detach finished subtrees, so that the tree never holds more
+                # than the path to the current element.
+                stack[-1].remove(element)
+                if element is not found:
+                    element.clear()
+        return found if index < 0 else None
+
     def parse_micros(self, usec):
         """Returns a `datetime` for the given microsecond string"""
         return datetime.datetime.utcfromtimestamp(usec / 1000000.0)
 
-    def get_blob(self, thread_id, blob_id):
+    def get_blob(self, thread_id, blob_id, offset=0):
         """Returns a file-like object with the contents of the given blob from
         the given thread.
 
         The object is described in detail here:
         https://docs.python.org/2/library/urllib2.html#urllib2.urlopen
+
+        If `offset` is given, only the contents from that byte on are
+        requested, with an HTTP Range header.
         """
-        request = Request(
-            url=self._url("blob/%s/%s" % (thread_id, blob_id)))
-        if self.access_token:
-            request.add_header("Authorization", "Bearer " + self.access_token)
+        headers = {"Range": "bytes=%d-" % offset} if offset else None
         try:
-            return urlopen(request, timeout=self.request_timeout)
+            return self._request(
+                self._url("blob/%s/%s" % (thread_id, blob_id)),
+                headers=headers)
         except HTTPError as error:
             try:
                 # Extract the developer-friendly error message from the response
@@ -754,23 +2826,105 @@ class QuipClient(object):
                 raise error
             raise QuipError(error.code, message, error)
 
-    def put_blob(self, thread_id, blob, name=None):
+    def download_blob(self, thread_id, blob_id, path=None, writer=None,
+                      chunk_size=1024 * 1024, resume=True):
+        """Streams the given blob to the file at `path`, or to the file-like
+        `writer`, in chunks of `chunk_size` bytes. Returns the size of the
+        blob.
+
+        If `path` already holds part of the blob, e.g. from an interrupted
+        download, only the rest is downloaded unless `resume` is False.
+        Raises `IOError` if the number of bytes received does not match the
+        size reported by the server.
+        """
+        import os
+        if (path is None) == (writer is None):
+            raise ValueError("Exactly one of path and writer is required")
+        offset = 0
+        if path is not None and resume and os.path.exists(path):
+            offset = os.path.getsize(path)
+        try:
+            response = self.get_blob(thread_id, blob_id, offset=offset)
+        except (HTTPError, QuipError) as error:
+            http_error = getattr(error, "http_error", error)
+            if offset and getattr(http_error, "code", None) == 416:
+                # The partial file already holds the whole blob.
+                content_range = http_error.headers.get("Content-Range", "")
+                if content_range.endswith("/%d" % offset):
+                    return offset
+            raise
+        try:
+            content_range = response.headers.get("Content-Range")
+            if response.getcode() != 206:
+                # The server ignored the Range header and sent everything.
+                offset = 0
+            length = response.headers.get("Content-Length")
+            if content_range and "/" in content_range and \
+                    not content_range.endswith("/*"):
+                expected = int(content_range.rsplit("/", 1)[1])
+            elif length is not None:
+                expected = offset + int(length)
+            else:
+                expected = None
+            if path is not None:
+                writer = open(path, "ab" if offset else "wb")
+            size = offset
+            try:
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    writer.write(chunk)
+                    size += len(chunk)
+            finally:
+                if path is not None:
+                    writer.close()
+        finally:
+            response.close()
+        if expected is not None and size != expected:
+            raise IOError("Incomplete download of blob %s: got %d of %d bytes"
+                          % (blob_id, size, expected))
+        return size
+
+    def put_blob(self, thread_id, blob, name=None, progress=None,
+                 chunk_size=64 * 1024):
         """Uploads an image or other blob to the given Quip thread. Returns an
         ID that can be used to add the image to the document of the thread.
 
-        blob can be any file-like object. Requires the 'requests' module.
+        blob can be any file-like object, or bytes. It is streamed in chunks
+        of `chunk_size` bytes; if given, `progress` is called with an
+        `UploadProgress` as the upload proceeds. Requires the 'requests'
+        module unless the client has a `connection_pool`.
         """
+        import os
+        filename = name or os.path.basename(getattr(blob, "name", "") or "")
+        encoder = MultipartEncoder(
+            "blob", blob, filename or "blob", chunk_size=chunk_size,
+            progress=progress)
+        headers = {"Content-Type": encoder.content_type}
+        if encoder.len is not None:
+            headers["Content-Length"] = str(encoder.len)
+        if self.connection_pool is not None:
+            try:
+                return json.loads(self._request(
+                    self._url("blob/" + thread_id), encoder,
+                    headers).read().decode())
+            except HTTPError as error:
+                try:
+                    # Extract the developer-friendly error message from the
+                    # response
+                    message = json.loads(
+                        error.read().decode())["error_description"]
+                except Exception:
+                    raise error
+                raise QuipError(error.code, message, error)
         import requests
         url = "blob/" + thread_id
-        headers = None
-        if self.access_token:
-            headers = {"Authorization": "Bearer " + self.access_token}
-        if name:
-            blob = (name, blob)
+        headers = self._request_headers(headers)
         try:
             response = requests.request(
                 "post", self._url(url), timeout=self.request_timeout,
-                files={"blob": blob}, headers=headers)
+                data=encoder, headers=headers)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as error:
@@ -786,32 +2940,224 @@ class QuipClient(object):
         """
         return self._fetch_json("websockets/new", **kwargs)
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(random.randint(1, 5)))
     def _fetch_json(self, path, post_data=None, **args):
-        request = Request(url=self._url(path, **args))
+        url = self._url(path, **args)
+        if not post_data and self.single_flight is not None:
+            return self.single_flight.do(
+                (self.access_token, url), lambda: self._load_json(url))
+        data = None
         if post_data:
             post_data = dict((k, v) for k, v in post_data.items()
                              if v or isinstance(v, int))
-            request_data = urlencode(self._clean(**post_data))
+            data = urlencode(self._clean(**post_data))
             if PY3:
-                request.data = request_data.encode()
+                data = data.encode()
+        return self._load_json(url, data)
+
+    def _fetch_cached_json(self, path):
+        cache = self.metadata_cache
+        if cache is None:
+            return self._fetch_json(path)
+        key = (self.base_url, self.access_token, path)
+        value = cache.get(key)
+        if value is None:
+            value = self._fetch_json(path)
+            cache.put(key, value)
+        return value
+
+    def _fetch_cached_batch(self, path, ids):
+        cache = self.metadata_cache
+        if cache is None:
+            return self._fetch_batches(path, ids)
+        result = {}
+        missing = []
+        for id in ids:
+            value = cache.get((self.base_url, self.access_token, path + id))
+            if value is None:
+                missing.append(id)
             else:
-                request.data = request_data
-
-        if self.access_token:
-            request.add_header("Authorization", "Bearer " + self.access_token)
+                result[id] = value
+        if missing:
+            fetched = self._fetch_batches(path, missing)
+            for id, value in iteritems(fetched):
+                cache.put((self.base_url, self.access_token, path + id), value)
+                result[id] = value
+        return result
+
+    def _fetch_batches(self, path, ids):
+        """Looks the given IDs up with the batch endpoint at `path`, in
+        concurrent requests of at most `max_batch_size` IDs each.
+        """
+        ids = list(ids)
+        chunks = [ids[i:i + self.max_batch_size]
+                  for i in range(0, len(ids), self.max_batch_size)]
+        if len(chunks) <= 1:
+            return self._fetch_json(path, post_data={"ids": ",".join(ids)})
+        from concurrent.futures import ThreadPoolExecutor
+        result = {}
+        with ThreadPoolExecutor(
+                max_workers=min(len(chunks), self.batch_workers)) as executor:
+            for batch in executor.map(self._bind_context(
+                    lambda chunk: self._fetch_json(
+                        path, post_data={"ids": ",".join(chunk)})), chunks):
+                result.update(batch)
+        return result
+
+    def _get_batched(self, path, id):
+        # Only callers with the same request context share a batcher, which
+        # sends its batches in that context, and a batcher is dropped once
+        # it has no callers, so that it never outlives their context.
+        context = getattr(self._local, "context", None) or {}
+        key = (path, self.access_token) + tuple(
+            (name, tuple(sorted(iteritems(value))) if name == "headers"
+             else value) for name, value in sorted(iteritems(context)))
+        with self._batchers_lock:
+            entry = self._batchers.get(key)
+            if entry is None:
+                fetch = {
+                    "users/": self.get_users,
+                    "folders/": self.get_folders,
+                    "threads/": self.get_threads,
+                }[path]
+                entry = self._batchers[key] = [MicroBatcher(
+                    self._bind_context(fetch), window=self.batch_window,
+                    max_batch_size=self.max_batch_size), 0]
+            entry[1] += 1
+        try:
+            return entry[0].get(id)
+        finally:
+            with self._batchers_lock:
+                entry[1] -= 1
+                if not entry[1] and self._batchers.get(key) is entry:
+                    del self._batchers[key]
+
+    def _invalidate_cached(self, path, ids):
+        if self.metadata_cache is not None:
+            for id in ids:
+                self.metadata_cache.invalidate(
+                    (self.base_url, self.access_token, path + id))
+
+    def _load_json(self, url, data=None):
+        headers = {"Accept-Encoding": "gzip, deflate"} if self.compression \
+            else None
         try:
-            return json.loads(
-                urlopen(
-                    request, timeout=self.request_timeout).read().decode())
+            response = self._request(url, data, headers)
+            return json_loads(
+                self._decode_body(response.read(), response.info()))
         except HTTPError as error:
             try:
                 # Extract the developer-friendly error message from the response
-                message = json.loads(error.read().decode())["error_description"]
+                message = json_loads(self._decode_body(
+                    error.read(), error.info()))["error_description"]
             except Exception:
                 raise error
             raise QuipError(error.code, message, error)
 
+    def _decode_body(self, body, headers):
+        encoding = headers.get("Content-Encoding") if headers else None
+        if encoding in ("gzip", "deflate"):
+            try:
+                # Accepts both gzip and zlib-wrapped deflate.
+                return zlib.decompress(body, zlib.MAX_WBITS | 32)
+            except zlib.error:
+                return zlib.decompress(body, -zlib.MAX_WBITS)
+        return body
+
+    def _iter_pages(self, fetch, next_cursor, cursor=None, prefetch=True):
+        """Yields the pages returned by `fetch(cursor)` until one is empty or
+        `next_cursor(page)` returns None.
+
+        With `prefetch`, the next page is fetched by a background thread
+        while the caller consumes the current one.
+        """
+        if not prefetch:
+            while True:
+                page = fetch(cursor)
+                if not page:
+                    return
+                yield page
+                cursor = next_cursor(page)
+                if cursor is None:
+                    return
+        from concurrent.futures import ThreadPoolExecutor
+        fetch = self._bind_context(fetch)
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = executor.submit(fetch, cursor)
+            while future is not None:
+                page = future.result()
+                if not page:
+                    return
+                cursor = next_cursor(page)
+                future = (executor.submit(fetch, cursor)
+                          if cursor is not None else None)
+                yield page
+        finally:
+            executor.shutdown(wait=False)
+
+    def _request(self, url, data=None, headers=None):
+        """Returns a file-like response for the given URL, sending `data` as
+        a POST body if given. Raises `HTTPError` for error statuses.
+        """
+        headers = self._request_headers(headers)
+        sinks = self.instrumentation + (self._context_value("profiles") or ())
+        instrumented = bool(sinks) or logging.getLogger().isEnabledFor(
+            logging.DEBUG)
+        start = time.time()
+        limiter = self.rate_limiter
+        attempt = 0
+        while True:
+            limiter.acquire()
+            try:
+                if self.connection_pool is not None:
+                    response = self.connection_pool.urlopen(
+                        url, data, headers, timeout=self.request_timeout)
+                else:
+                    response = urlopen(
+                        Request(url=url, data=data, headers=headers),
+                        timeout=self.request_timeout, context=self.ssl_context)
+            except HTTPError as error:
+                limiter.update(error.info())
+                delay = limiter.retry_delay(attempt, error.code, error.info())
+                if delay is None or not isinstance(data, (bytes, type(None))):
+                    if instrumented:
+                        self._record(sinks, url, data, error.code, int(
+                            error.info().get("Content-Length") or 0),
+                            attempt, start)
+                    raise
+            except (URLError, HTTPException, socket.error):
+                delay = limiter.retry_delay(attempt)
+                if delay is None or not isinstance(data, (bytes, type(None))):
+                    if instrumented:
+                        self._record(sinks, url, data, 0, 0, attempt, start)
+                    raise
+            else:
+                limiter.update(response.info())
+                if instrumented:
+                    status = response.getcode()
+                    retries = attempt
+                    return _MeteredResponse(
+                        response, lambda bytes_in: self._record(
+                            sinks, url, data, status, bytes_in, retries,
+                            start))
+                return response
+            attempt += 1
+            time.sleep(delay)
+
+    def _record(self, sinks, url, data, status, bytes_in, retries, start):
+        if isinstance(data, bytes):
+            bytes_out = len(data)
+        else:
+            bytes_out = getattr(data, "len", None) or 0
+        record = RequestRecord(
+            "GET" if data is None else "POST", _endpoint(url), status,
+            bytes_in, bytes_out, retries, time.time() - start)
+        logging.debug("Quip %s %s: %d, %d bytes in, %d retries, %.3fs",
+                      record.method, record.endpoint, record.status,
+                      record.bytes_in, record.retries, record.seconds)
+        for sink in sinks:
+            sink.record(record)
+
     def _clean(self, **args):
         return dict((k, str(v) if isinstance(v, int) else v.encode("utf-8"))
                     for k, v in args.items() if v or isinstance(v, int))
@@ -822,3 +3168,127 @@ class QuipClient(object):
         if args:
             url += "?" + urlencode(args)
         return url
+
+
+MessageEvent = collections.namedtuple(
+    "MessageEvent", ["thread_id", "thread", "message", "user", "data"])
+ThreadEvent = collections.namedtuple(
+    "ThreadEvent", ["thread_id", "thread", "data"])
+
+
+class WebsocketListener(object):
+    """Listens to the change feed of a Quip websocket.
+
+    Connects to a URL from `QuipClient.new_websocket`, keeps the connection
+    alive with heartbeats and reconnects with exponential backoff (and a
+    fresh URL) whenever it drops. Every event that concerns a thread is
+    passed to `on_thread` as a `ThreadEvent`; new messages are also passed
+    to `on_message` as a `MessageEvent`. Other events go to `on_event` as
+    decoded JSON.
+
+        client = quip.QuipClient(access_token=...)
+        listener = quip.WebsocketListener(
+            client, on_message=lambda event: print(event.message["text"]))
+        listener.start()
+
+    If `document_cache` is given, the cached document of every changed thread
+    is invalidated. Callbacks run on the listener thread, so they should return
+    quickly. Requires the 'websocket-client' module.
+    """
+
+    def __init__(self, client, on_message=None, on_thread=None,
+                 on_event=None, on_error=None, document_cache=None,
+                 heartbeat_interval=20, backoff=1, max_backoff=60):
+        self.client = client
+        self.on_message = on_message
+        self.on_thread = on_thread
+        self.on_event = on_event
+        self.on_error = on_error
+        self.document_cache = document_cache
+        self.heartbeat_interval = heartbeat_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._stopped = threading.Event()
+        self._socket = None
+        self._thread = None
+
+    def start(self):
+        """Runs the listener on a daemon thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, name="quip-websocket")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops the listener and waits for its thread to finish."""
+        self._stopped.set()
+        socket_ = self._socket
+        if socket_ is not None:
+            try:
+                socket_.close()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        """Listens until `stop` is called."""
+        import websocket
+        attempt = 0
+        while not self._stopped.is_set():
+            try:
+                url = self.client.new_websocket()["url"]
+                self._socket = websocket.create_connection(
+                    url, timeout=self.heartbeat_interval)
+                attempt = 0
+                self._listen(websocket)
+            except Exception as error:
+                if self._stopped.is_set():
+                    break
+                if self.on_error is not None:
+                    self.on_error(error)
+                else:
+                    logging.warning("Quip websocket failed: %s", error)
+            finally:
+                if self._socket is not None:
+                    try:
+                        self._socket.close()
+                    except Exception:
+                        pass
+                    self._socket = None
+            delay = random.uniform(
+                0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            attempt += 1
+            self._stopped.wait(delay)
+
+    def _listen(self, websocket):
+        last_heartbeat = time.time()
+        while not self._stopped.is_set():
+            if time.time() - last_heartbeat >= self.heartbeat_interval:
+                self._socket.send(json.dumps({"type": "heartbeat"}))
+                last_heartbeat = time.time()
+            try:
+                data = self._socket.recv()
+            except websocket.WebSocketTimeoutException:
+                continue
+            if not data:
+                raise websocket.WebSocketConnectionClosedException(
+                    "Connection closed by the server")
+            self._dispatch(json.loads(data))
+
+    def _dispatch(self, data):
+        if data.get("type") == "error":
+            raise Exception("Quip websocket error: %s" % data.get("debug"))
+        thread = data.get("thread")
+        if not thread:
+            if self.on_event is not None and data.get("type") != "alive":
+                self.on_event(data)
+            return
+        thread_id = thread.get("id")
+        if self.document_cache is not None:
+            self.document_cache.invalidate(thread_id)
+        if self.on_thread is not None:
+            self.on_thread(ThreadEvent(thread_id, thread, data))
+        if data.get("message") and self.on_message is not None:
+            self.on_message(MessageEvent(
+                thread_id, thread, data["message"], data.get("user"), data))
@@ -0,0 +1,536 @@
+"""An asyncio version of the Quip API client.
+
+Typical usage:
+
+    async with quip_async.AsyncQuipClient(access_token=...) as client:
+        threads = await asyncio.gather(
+            *[client.get_thread(id) for id in thread_ids])
+
+`AsyncQuipClient` exposes the same methods as `quip.QuipClient`, but every
+method that talks to the API is a coroutine. All requests of a client share
+one `aiohttp` connection pool, and at most `max_concurrency` of them are in
+flight at any time. Requires the 'aiohttp' module.
+"""
+
+import asyncio
+import json
+
+import aiohttp
+
+import quip
+
+
+class AsyncQuipClient(quip.QuipClient):
+    """An asyncio Quip API client"""
+
+    def __init__(self, access_token=None, client_id=None, client_secret=None,
+                 base_url=None, request_timeout=None, max_concurrency=50,
+                 session=None, rate_limiter=None):
+        """Constructs an asyncio Quip API client.
+
+        `max_concurrency` caps the number of requests in flight. If
+        `session` is given, it is used instead of a client-owned
+        `aiohttp.ClientSession` and is not closed by `close`. Requests are
+        throttled and retried by `rate_limiter` (see `quip.RateLimiter`).
+
+        As in `quip.QuipClient`, `request_timeout` bounds connecting and
+        every read, not whole requests, so long blob transfers complete.
+        """
+        quip.QuipClient.__init__(
+            self, access_token=access_token, client_id=client_id,
+            client_secret=client_secret, base_url=base_url,
+            request_timeout=request_timeout, rate_limiter=rate_limiter)
+        self.max_concurrency = max_concurrency
+        self._session = session
+        self._owns_session = session is None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Closes the client's connection pool."""
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+            self._session = None
+
+    async def move_thread(self, thread_id, source_folder_id,
+                          destination_folder_id):
+        """Moves the given thread from the source folder to the destination one.
+        """
+        await self.add_thread_members(thread_id, [destination_folder_id])
+        await self.remove_thread_members(thread_id, [source_folder_id])
+
+    async def iter_messages(self, thread_id, min_created_usec=None,
+                            max_created_usec=None, page_size=100,
+                            prefetch=True):
+        """Yields the messages of the given thread, most recent first (see
+        `quip.QuipClient.iter_messages`):
+
+            async for message in client.iter_messages(thread_id):
+                ...
+        """
+        cursor = self._messages_cursor(min_created_usec)
+
+        async def fetch(max_created_usec):
+            return await self.get_messages(
+                thread_id, max_created_usec=max_created_usec, count=page_size)
+
+        async for page in self._iter_pages(
+                fetch, cursor.next_cursor, max_created_usec, prefetch):
+            for message in cursor.take(page):
+                yield message
+
+    async def iter_recent_threads(self, min_updated_usec=None,
+                                  max_updated_usec=None, page_size=50,
+                                  prefetch=True, **kwargs):
+        """Yields the recently updated threads, most recently updated first
+        (see `quip.QuipClient.iter_recent_threads`).
+        """
+        cursor = self._recent_threads_cursor(min_updated_usec)
+
+        async def fetch(max_updated_usec):
+            threads = await self.get_recent_threads(
+                max_updated_usec=max_updated_usec, count=page_size, **kwargs)
+            return cursor.sort(threads.values())
+
+        async for page in self._iter_pages(
+                fetch, cursor.next_cursor, max_updated_usec, prefetch):
+            for thread in cursor.take(page):
+                yield thread
+
+    async def merge_comments(self, original_id, children_ids,
+                             ignore_user_ids=[]):
+        """Given an original document and a set of exact duplicates, copies
+        all comments and messages on the duplicates to the original.
+
+        Messages of all duplicates are fetched concurrently; they are copied
+        to the original one thread at a time, in order.
+        """
+        threads, all_messages = await asyncio.gather(
+            self.get_threads(children_ids + [original_id]),
+            asyncio.gather(*[self.get_messages(thread_id)
+                             for thread_id in children_ids]))
+        original = self.parse_document(threads[original_id]["html"])
+        for thread_id, messages in zip(children_ids, all_messages):
+            thread = threads[thread_id]
+            parent_map = self.parse_document(
+                thread["html"]).map_sections(original)
+            for message in reversed(messages):
+                if message["author_id"] in ignore_user_ids:
+                    continue
+                kwargs = {
+                    "user_id": message["author_id"],
+                    "frame": "bubble",
+                    "service_id": message["id"],
+                }
+                if "parts" in message:
+                    kwargs["parts"] = json.dumps(message["parts"])
+                else:
+                    kwargs["content"] = message["text"]
+                if "annotation" in message:
+                    section_id = None
+                    if "highlight_section_ids" in message["annotation"]:
+                        section_id = message["annotation"][
+                            "highlight_section_ids"][0]
+                    else:
+                        anno_loc = thread["html"].find(
+                            '<annotation id="%s"' % message["annotation"]["id"])
+                        loc = thread["html"].rfind("id=", 0, anno_loc)
+                        if anno_loc >= 0 and loc >= 0:
+                            section_id = thread["html"][loc + 4:loc + 15]
+                    if section_id and section_id in parent_map:
+                        kwargs["section_id"] = parent_map[section_id]
+                if "files" in message:
+                    blobs = await asyncio.gather(*[
+                        self.get_blob(thread_id, blob_info["hash"])
+                        for blob_info in message["files"]])
+                    new_blobs = await asyncio.gather(*[
+                        self.put_blob(original_id, blob, name=blob_info["name"])
+                        for blob, blob_info in zip(blobs, message["files"])])
+                    attachments = [new_blob["id"] for new_blob in new_blobs]
+                    if attachments:
+                        kwargs["attachments"] = ",".join(attachments)
+                await self.new_message(original_id, **kwargs)
+
+    async def sync_document(self, thread_id, content, document_html=None):
+        """Edits the given document so that its sections match the given HTML,
+        leaving unchanged sections untouched (see
+        `quip.QuipClient.sync_document`).
+
+        The edits are sent one at a time, in order.
+        """
+        if document_html is None:
+            document_html = (await self._get_html(thread_id)) or ""
+        edits, result = self._plan_sync(document_html, content)
+        for html, operation, section_id in edits:
+            await self.edit_document(thread_id, html, operation,
+                                     section_id=section_id)
+        return result
+
+    async def add_to_first_list(self, thread_id, *items, **kwargs):
+        """Adds the given items to the first list in the given document."""
+        return (await self._add_to_list(thread_id, items, **kwargs))[0]
+
+    async def bulk_add_to_first_list(self, thread_id, items,
+                                     max_bytes=256 * 1024, progress=None,
+                                     **kwargs):
+        """Adds the items of the given iterable to the first list in the given
+        document, in order, with as many edits as it takes to keep each under
+        `max_bytes` of content. Returns a `quip.InsertProgress`.
+        """
+        return (await self._add_to_list(
+            thread_id, items, max_bytes=max_bytes, progress=progress,
+            **kwargs))[1]
+
+    async def _add_to_list(self, thread_id, items, max_bytes=256 * 1024,
+                           progress=None, **kwargs):
+        first_list = None
+        if "section_id" not in kwargs:
+            first_list = await self.get_first_list(
+                thread_id, kwargs.pop("document_html", None))
+        pieces, render, args = self._plan_list_insert(
+            items, first_list, kwargs)
+        return await self._insert_in_chunks(
+            thread_id, pieces, render, "li", max_bytes, progress, **args)
+
+    async def add_to_spreadsheet(self, thread_id, *rows, **kwargs):
+        """Adds the given rows to the named (or first) spreadsheet in the
+        given document.
+        """
+        return (await self._add_to_spreadsheet(thread_id, rows, **kwargs))[0]
+
+    async def bulk_add_to_spreadsheet(self, thread_id, rows, name=None,
+                                      add_to_top=False, max_bytes=256 * 1024,
+                                      progress=None):
+        """Adds the rows of the given iterable to the named (or first)
+        spreadsheet in the given document, in order, with as many edits as it
+        takes to keep each under `max_bytes` of content. Returns a
+        `quip.InsertProgress`.
+        """
+        return (await self._add_to_spreadsheet(
+            thread_id, rows, name=name, add_to_top=add_to_top,
+            max_bytes=max_bytes, progress=progress))[1]
+
+    async def _add_to_spreadsheet(self, thread_id, rows, name=None,
+                                  add_to_top=False, max_bytes=256 * 1024,
+                                  progress=None):
+        if name:
+            spreadsheet = await self.get_named_spreadsheet(name, thread_id)
+        else:
+            spreadsheet = await self.get_first_spreadsheet(thread_id)
+        pieces, render, args = self._plan_spreadsheet_insert(
+            rows, spreadsheet, add_to_top)
+        return await self._insert_in_chunks(
+            thread_id, pieces, render, "tr", max_bytes, progress, **args)
+
+    async def _insert_in_chunks(self, thread_id, pieces, render, tag,
+                                max_bytes, progress, section_id=None,
+                                operation=quip.QuipClient.APPEND, **args):
+        """Like `quip.QuipClient._insert_in_chunks`; the edits are sent one
+        at a time, in order.
+        """
+        insert = quip._ChunkedInsert(self, thread_id, render, tag, progress,
+                                     section_id, operation, args)
+        for chunk, size in self._chunk_pieces(pieces, max_bytes):
+            if insert.needs_document():
+                insert.document_html = await self._get_html(thread_id)
+            insert.sent(chunk, size,
+                        await self.edit_document(**insert.edit(chunk)))
+        return insert.response, insert.stats
+
+    async def update_spreadsheet_row(self, thread_id, header, value, updates,
+                                     spreadsheet_index=None, **args):
+        """Finds the row where the given header column is the given value, and
+        applies the given updates. If no row is found, adds a new one.
+
+        Cell updates of the row are sent concurrently. If a
+        `quip.SpreadsheetIndex` of the spreadsheet is given, the row is
+        looked up in it instead of downloading the spreadsheet, and added
+        rows are added to it.
+        """
+        if spreadsheet_index is not None:
+            last_row_id = spreadsheet_index.last_row_id()
+            edits, added = self._plan_indexed_row(
+                header, value, updates, spreadsheet_index)
+            responses = await asyncio.gather(*[
+                self.edit_document(thread_id=thread_id, **dict(edit, **args))
+                for edit in edits])
+            response = responses[-1] if responses else None
+            if added:
+                html = response.get("html") if isinstance(response, dict) \
+                    else None
+                self._index_added_row(
+                    spreadsheet_index, html or await self._get_html(thread_id),
+                    last_row_id)
+            return response
+        if args.get("name"):
+            spreadsheet = await self.get_named_spreadsheet(
+                args["name"], thread_id)
+        else:
+            spreadsheet = await self.get_first_spreadsheet(thread_id)
+        headers = self.get_spreadsheet_header_items(spreadsheet)
+        row = self.find_row_from_header(spreadsheet, header, value)
+        if not row:
+            updates[header] = value
+            return await self.add_spreadsheet_row(
+                thread_id, spreadsheet, updates, headers=headers, **args)
+        ids = self.get_row_ids(row)
+        edits = []
+        for head, val in quip.iteritems(updates):
+            index = self.get_index_of_header(headers, head)
+            if not index or index >= len(ids) or not ids[index]:
+                continue
+            edits.append(self.edit_document(
+                thread_id=thread_id,
+                content=val,
+                format="markdown",
+                section_id=ids[index],
+                operation=self.REPLACE_SECTION,
+                **args))
+        responses = await asyncio.gather(*edits)
+        return responses[-1] if responses else None
+
+    async def update_spreadsheet_rows(self, thread_id, header, rows, **args):
+        """Like `quip.QuipClient.update_spreadsheet_rows`; the edits of the
+        rows are sent concurrently.
+        """
+        if isinstance(rows, dict):
+            rows = quip.iteritems(rows)
+        rows = list(rows)
+        if args.get("name"):
+            spreadsheet = await self.get_named_spreadsheet(
+                args["name"], thread_id)
+        else:
+            spreadsheet = await self.get_first_spreadsheet(thread_id)
+        edits = self._plan_spreadsheet_rows(spreadsheet, header, rows)
+        responses = await asyncio.gather(*[
+            self.edit_document(thread_id=thread_id, **dict(edit, **args))
+            for edit, _ in edits])
+        results = [None] * len(rows)
+        for (_, positions), response in zip(edits, responses):
+            for position in positions:
+                results[position] = response
+        return results
+
+    async def get_section(self, section_id, thread_id=None,
+                          document_html=None):
+        document_html = document_html or await self._get_html(thread_id)
+        if not document_html:
+            return None
+        return quip.QuipClient.get_section(
+            self, section_id, document_html=document_html)
+
+    async def get_named_spreadsheet(self, name, thread_id=None,
+                                    document_html=None):
+        document_html = document_html or await self._get_html(thread_id)
+        if not document_html:
+            return None
+        return quip.QuipClient.get_named_spreadsheet(
+            self, name, document_html=document_html)
+
+    async def _get_container(self, thread_id, document_html, container, index):
+        document_html = document_html or await self._get_html(thread_id)
+        if not document_html:
+            return None
+        return quip.QuipClient._get_container(
+            self, None, document_html, container, index)
+
+    async def _get_html(self, thread_id):
+        return (await self.get_thread(thread_id)).get("html")
+
+    async def get_blob(self, thread_id, blob_id, offset=0):
+        """Returns the contents of the given blob from the given thread as
+        bytes.
+
+        If `offset` is given, only the contents from that byte on are
+        requested, with an HTTP Range header.
+        """
+        return await self._request(
+            "GET", self._url("blob/%s/%s" % (thread_id, blob_id)),
+            headers={"Range": "bytes=%d-" % offset} if offset else None,
+            timeout=self._timeout())
+
+    async def download_blob(self, thread_id, blob_id, path=None, writer=None,
+                            chunk_size=1024 * 1024, resume=True):
+        """Streams the given blob to the file at `path`, or to the file-like
+        `writer`, in chunks of `chunk_size` bytes. Returns the size of the
+        blob.
+
+        Resumes partial files like `quip.QuipClient.download_blob`. The
+        download is not retried; call again to resume it. Writes to the file
+        or `writer` block the event loop.
+        """
+        import os
+        if (path is None) == (writer is None):
+            raise ValueError("Exactly one of path and writer is required")
+        offset = 0
+        if path is not None and resume and os.path.exists(path):
+            offset = os.path.getsize(path)
+        headers = {"Range": "bytes=%d-" % offset} if offset else {}
+        if self.access_token:
+            headers["Authorization"] = "Bearer " + self.access_token
+        session = self._get_session()
+        await asyncio.sleep(self.rate_limiter.reserve())
+        async with self._semaphore:
+            async with session.get(
+                    self._url("blob/%s/%s" % (thread_id, blob_id)),
+                    headers=headers, timeout=self._timeout()) as response:
+                self.rate_limiter.update(response.headers)
+                content_range = response.headers.get("Content-Range", "")
+                if offset and response.status == 416 and \
+                        content_range.endswith("/%d" % offset):
+                    # The partial file already holds the whole blob.
+                    return offset
+                if response.status >= 400:
+                    raise self._error(response, await response.read())
+                if response.status != 206:
+                    # The server ignored the Range header and sent everything.
+                    offset = 0
+                if "/" in content_range and not content_range.endswith("/*"):
+                    expected = int(content_range.rsplit("/", 1)[1])
+                elif response.content_length is not None:
+                    expected = offset + response.content_length
+                else:
+                    expected = None
+                if path is not None:
+                    writer = open(path, "ab" if offset else "wb")
+                size = offset
+                try:
+                    async for chunk in response.content.iter_chunked(
+                            chunk_size):
+                        writer.write(chunk)
+                        size += len(chunk)
+                finally:
+                    if path is not None:
+                        writer.close()
+        if expected is not None and size != expected:
+            raise IOError("Incomplete download of blob %s: got %d of %d bytes"
+                          % (blob_id, size, expected))
+        return size
+
+    async def put_blob(self, thread_id, blob, name=None):
+        """Uploads an image or other blob to the given Quip thread. Returns an
+        ID that can be used to add the image to the document of the thread.
+
+        blob can be bytes or any file-like object.
+        """
+        data = aiohttp.FormData()
+        data.add_field("blob", blob, filename=name or "blob")
+        return quip.json_loads((await self._request(
+            "POST", self._url("blob/" + thread_id), data,
+            timeout=self._timeout())))
+
+    async def _fetch_batches(self, path, ids):
+        ids = list(ids)
+        result = {}
+        for batch in await asyncio.gather(*[
+                self._fetch_json(path, post_data={
+                    "ids": ",".join(ids[i:i + self.max_batch_size])})
+                for i in range(0, len(ids), self.max_batch_size)]):
+            result.update(batch)
+        return result
+
+    async def _iter_pages(self, fetch, next_cursor, cursor=None,
+                          prefetch=True):
+        """Yields the pages returned by `fetch(cursor)` until one is empty or
+        `next_cursor(page)` returns None.
+
+        With `prefetch`, the next page is fetched by a task while the caller
+        consumes the current one.
+        """
+        task = asyncio.ensure_future(fetch(cursor))
+        try:
+            while task is not None:
+                page = await task
+                task = None
+                if not page:
+                    return
+                cursor = next_cursor(page)
+                if cursor is not None:
+                    task = fetch(cursor)
+                    if prefetch:
+                        task = asyncio.ensure_future(task)
+                yield page
+        finally:
+            if task is not None:
+                if asyncio.isfuture(task):
+                    task.cancel()
+                else:
+                    task.close()
+
+    async def _fetch_json(self, path, post_data=None, **args):
+        data = None
+        if post_data:
+            post_data = dict((k, v) for k, v in post_data.items()
+                             if v or isinstance(v, int))
+            data = quip.urlencode(self._clean(**post_data)).encode()
+        return quip.json_loads((await self._request(
+            "GET" if data is None else "POST", self._url(path, **args), data,
+            None if data is None else
+            {"Content-Type": "application/x-www-form-urlencoded"})))
+
+    async def _request(self, method, url, data=None, headers=None,
+                       timeout=None):
+        headers = dict(headers or {})
+        if self.access_token:
+            headers["Authorization"] = "Bearer " + self.access_token
+        session = self._get_session()
+        limiter = self.rate_limiter
+        attempt = 0
+        while True:
+            await asyncio.sleep(limiter.reserve())
+            try:
+                async with self._semaphore:
+                    async with session.request(
+                            method, url, data=data, headers=headers,
+                            timeout=timeout or session.timeout) as response:
+                        body = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                delay = limiter.retry_delay(attempt)
+                if delay is None or not isinstance(data, (bytes, type(None))):
+                    raise
+            else:
+                limiter.update(response.headers)
+                if response.status < 400:
+                    break
+                delay = limiter.retry_delay(
+                    attempt, response.status, response.headers)
+                if delay is None or not isinstance(data, (bytes, type(None))):
+                    break
+            attempt += 1
+            await asyncio.sleep(delay)
+        if response.status >= 400:
+            raise self._error(response, body)
+        return body
+
+    def _error(self, response, body):
+        error = aiohttp.ClientResponseError(
+            response.request_info, response.history,
+            status=response.status, message=response.reason,
+            headers=response.headers)
+        try:
+            # Extract the developer-friendly error message from the response
+            message = quip.json_loads(body)["error_description"]
+        except Exception:
+            return error
+        return quip.QuipError(response.status, message, error)
+
+    def _get_session(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=self._timeout())
+        return self._session
+
+    def _timeout(self):
+        # Blob transfers pass this explicitly too, so that they are not cut
+        # short by the total timeout of a session given by the caller.
+        return aiohttp.ClientTimeout(
+            total=None, sock_connect=self.request_timeout,
+            sock_read=self.request_timeout)
@@ -0,0 +1,991 @@
+"""Offline benchmarks for the Quip API client.
+
+The benchmarks run `quip.QuipClient` against `StandInServer`, a local HTTP
+server that answers like platform.quip.com with synthetic responses of
+realistic sizes, so they need neither network access nor a Quip account:
+
+    python quip_benchmark.py transport parsing spreadsheet threads suite search
+
+Each benchmark prints a table of its measurements. `suite` runs every
+scenario in `SCENARIOS` (get_thread, the spreadsheet helpers, message
+paging, merge_comments and blob transfers) in a fresh process, and reports
+its p50 and p99 latency, throughput, traffic and peak RSS. `websocket`
+measures the event throughput, dispatch latency and reconnection time of
+`quip.WebsocketListener` against the stand-in's websocket.
+"""
+
+import argparse
+import base64
+import collections
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import quip
+
+WORDS = (
+    "quip api thread document folder message section spreadsheet list "
+    "customer revenue quarter pipeline forecast launch review draft team "
+    "project status update owner deadline budget metric growth target "
+    "meeting notes action item blocked done pending approved"
+).split()
+
+
+def synthetic_id(rng):
+    chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+    return "".join(rng.choice(chars) for _ in range(11))
+
+
+def synthetic_document(size, seed=0, rows=200, columns=8):
+    """Returns Quip-style document HTML of about `size` bytes: headings,
+    paragraphs and lists of prose, and a spreadsheet of `rows` rows.
+    """
+    rng = random.Random(seed)
+    parts = []
+    table = ["<table id='%s' title='Sheet1'><thead><tr id='%s'>" % (
+        synthetic_id(rng), synthetic_id(rng))]
+    table.extend(["<th id='%s'>%s</th>" % (synthetic_id(rng), chr(65 + i))
+                  for i in range(columns)])
+    table.append("</tr></thead><tbody>")
+    table.append("<tr id='%s'>%s</tr>" % (synthetic_id(rng), "".join([
+        "<td id='%s'>Header%d</td>" % (synthetic_id(rng), i)
+        for i in range(columns)])))
+    for row in range(rows):
+        table.append("<tr id='%s'>%s</tr>" % (synthetic_id(rng), "".join([
+            "<td id='%s'>%s</td>" % (
+                synthetic_id(rng),
+                "row%d" % row if i == 0 else rng.choice(WORDS))
+            for i in range(columns)])))
+    table.append("</tbody></table>")
+    table = "".join(table)
+    length = len(table)
+    while length < size:
+        kind = rng.random()
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 60)))
+        if kind < 0.1:
+            part = "<h2 id='%s'>%s</h2>" % (synthetic_id(rng), text[:40])
+        elif kind < 0.25:
+            part = "<ul id='%s'>%s</ul>" % (synthetic_id(rng), "".join([
+                "<li id='%s'>%s</li>" % (synthetic_id(rng), text[:30])
+                for _ in range(rng.randint(2, 6))]))
+        else:
+            part = "<p id='%s'>%s</p>" % (synthetic_id(rng), text)
+        parts.append(part)
+        length += len(part)
+    parts.insert(len(parts) // 2, table)
+    return "".join(parts)
+
+
+class StandInServer(object):
+    """A local stand-in for platform.quip.com.
+
+    Serves synthetic threads whose documents are about `document_size` bytes,
+    with `messages_per_thread` messages each, some with annotations and
+    attachments, and blobs of `blob_size` bytes (with Range requests), over
+    keep-alive HTTP/1.1. JSON responses are compressed when the client
+    accepts gzip or deflate. Edits, new messages and uploaded blobs are
+    answered like Quip answers them. `requests`, `bytes_sent` and
+    `bytes_received` count the traffic since the last `reset_counters`.
+
+        with StandInServer() as server:
+            client = quip.QuipClient("token", base_url=server.base_url)
+
+    `new_websocket` returns the URL of the server's websocket, which answers
+    heartbeats like Quip's. Events are sent to every connected websocket
+    with `publish`, and `drop_websockets` closes them all, so that
+    listeners have to reconnect. `websocket_connections` and `heartbeats`
+    count the connections accepted and the heartbeats received.
+    """
+
+    def __init__(self, document_size=512 * 1024, latency=0,
+                 messages_per_thread=250, blob_size=4 * 1024 * 1024):
+        self.document_size = document_size
+        self.latency = latency
+        self.messages_per_thread = messages_per_thread
+        self.blob_size = blob_size
+        self._lock = threading.Lock()
+        self._threads = {}
+        self._messages = {}
+        self._blob = None
+        self._encoded = {}
+        self._websockets = []
+        self._server = None
+        self.websocket_connections = 0
+        self.heartbeats = 0
+        self.reset_counters()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:%d" % self._server.server_port
+
+    def start(self):
+        server = self
+
+        class Handler(_Handler):
+            stand_in = server
+
+        self._server = _Server(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+    def thread(self, thread_id):
+        """Returns the synthetic thread with the given ID."""
+        with self._lock:
+            if thread_id not in self._threads:
+                seed = zlib.crc32(thread_id.encode())
+                self._threads[thread_id] = {
+                    "thread": {
+                        "id": thread_id,
+                        "title": "Thread %s" % thread_id,
+                        "type": "document",
+                        "created_usec": 1500000000000000,
+                        "updated_usec": 1500000000000000 + seed,
+                        "link": "https://quip.com/%s" % thread_id,
+                    },
+                    "user_ids": ["user%d" % i for i in range(5)],
+                    "html": synthetic_document(self.document_size, seed),
+                }
+            return self._threads[thread_id]
+
+    def copy_thread(self, thread_id, copy_id):
+        """Adds a duplicate of the given thread, with new section IDs."""
+        thread = self.thread(thread_id)
+        rng = random.Random(copy_id)
+        with self._lock:
+            self._threads[copy_id] = {
+                "thread": dict(thread["thread"], id=copy_id,
+                               link="https://quip.com/%s" % copy_id),
+                "user_ids": list(thread["user_ids"]),
+                "html": re.sub(r" id='\w+'", lambda match: " id='%s'" % (
+                    synthetic_id(rng)), thread["html"]),
+            }
+        return self._threads[copy_id]
+
+    def messages(self, thread_id):
+        """Returns the synthetic messages of the given thread, most recent
+        first. Every 7th message comments on a section of the document, and
+        every 10th has an attachment.
+        """
+        section_ids = re.findall(r" id='(\w+)'", self.thread(thread_id)["html"])
+        with self._lock:
+            if thread_id not in self._messages:
+                rng = random.Random(thread_id)
+                messages = []
+                for i in range(self.messages_per_thread):
+                    message = {
+                        "id": synthetic_id(rng),
+                        "thread_id": thread_id,
+                        "author_id": "user%d" % (i % 5),
+                        "created_usec": 1600000000000000 - i * 1000,
+                        "text": " ".join(rng.choice(WORDS)
+                                         for _ in range(rng.randint(3, 30))),
+                    }
+                    if i % 7 == 3 and section_ids:
+                        message["annotation"] = {
+                            "id": synthetic_id(rng),
+                            "highlight_section_ids": [
+                                section_ids[i % len(section_ids)]],
+                        }
+                    if i % 10 == 5:
+                        message["files"] = [{"hash": synthetic_id(rng),
+                                             "name": "attachment%d.bin" % i}]
+                    messages.append(message)
+                self._messages[thread_id] = messages
+            return self._messages[thread_id]
+
+    def publish(self, event):
+        """Sends the given event, as JSON, to every connected websocket.
+        Returns the number of websockets it was sent to.
+        """
+        with self._lock:
+            websockets = list(self._websockets)
+        for websocket in websockets:
+            websocket.send_frame(1, json.dumps(event).encode())
+        return len(websockets)
+
+    def drop_websockets(self):
+        """Closes every connected websocket without a close frame."""
+        with self._lock:
+            websockets = list(self._websockets)
+        for websocket in websockets:
+            try:
+                websocket.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    @property
+    def open_websockets(self):
+        with self._lock:
+            return len(self._websockets)
+
+    def blob(self):
+        """Returns the contents of every blob: `blob_size` random bytes."""
+        with self._lock:
+            if self._blob is None:
+                self._blob = os.urandom(self.blob_size)
+            return self._blob
+
+    def respond(self, method, path, query, body, headers=None):
+        """Returns the status, headers and body (bytes, or an object to be
+        sent as JSON) of the response to a request.
+        """
+        match = re.match(r"^/1/threads/([\w-]+)$", path)
+        if method == "GET" and match and match.group(1) not in (
+                "recent", "search"):
+            return 200, {}, ("thread", match.group(1))
+        if path == "/1/threads/edit-document" and method == "POST":
+            try:
+                return 200, {}, self.edit_document(_form(body))
+            except (KeyError, ValueError) as error:
+                return 400, {}, {"error_code": 400,
+                                 "error_description": str(error)}
+        if path == "/1/threads/" and method == "POST":
+            ids = _form(body).get("ids", "").split(",")
+            return 200, {}, dict(
+                (thread_id, self.thread(thread_id)) for thread_id in ids)
+        match = re.match(r"^/1/messages/([\w-]+)$", path)
+        if method == "GET" and match and match.group(1) != "new":
+            args = _form(query.encode())
+            count = min(int(args.get("count", 25)), 100)
+            max_usec = int(args.get("max_created_usec", 1 << 62))
+            return 200, {}, [message for message in self.messages(
+                match.group(1)) if message["created_usec"] <= max_usec][:count]
+        if path == "/1/messages/new" and method == "POST":
+            args = _form(body)
+            return 200, {}, {
+                "id": synthetic_id(random.Random()),
+                "thread_id": args.get("thread_id"),
+                "author_id": args.get("user_id", "user0"),
+                "created_usec": int(time.time() * 1000000),
+                "text": args.get("content", ""),
+            }
+        match = re.match(r"^/1/blob/([\w-]+)/([\w-]+)$", path)
+        if method == "GET" and match:
+            return self._blob_response((headers or {}).get("Range"))
+        match = re.match(r"^/1/blob/([\w-]+)$", path)
+        if method == "POST" and match:
+            blob_id = synthetic_id(random.Random())
+            return 200, {}, {"id": blob_id, "url": "/blob/%s/%s" % (
+                match.group(1), blob_id)}
+        if path == "/1/websockets/new":
+            return 200, {}, {
+                "url": "ws://127.0.0.1:%d/websocket" % (
+                    self._server.server_port),
+                "user_id": "user0",
+            }
+        match = re.match(r"^/1/users/([\w-]+)$", path)
+        if match:
+            return 200, {}, {"id": match.group(1), "name": "User"}
+        return 404, {}, {"error_code": 404,
+                         "error_description": "No route for %s" % path}
+
+    def _blob_response(self, range_header):
+        blob = self.blob()
+        headers = {"Content-Type": "application/octet-stream",
+                   "Accept-Ranges": "bytes"}
+        match = re.match(r"^bytes=(\d+)-$", range_header or "")
+        if not match:
+            return 200, headers, blob
+        start = int(match.group(1))
+        if start >= len(blob):
+            headers["Content-Range"] = "bytes */%d" % len(blob)
+            return 416, headers, b""
+        headers["Content-Range"] = "bytes %d-%d/%d" % (
+            start, len(blob) - 1, len(blob))
+        return 206, headers, blob[start:]
+
+    def edit_document(self, args):
+        """Applies an edit-document request to the synthetic thread, as
+        Quip would for simple HTML and markdown content, and returns the
+        thread.
+        """
+        thread = self.thread(args["thread_id"])
+        operation = int(args.get("location", 0))
+        content = args.get("content", "")
+        if args.get("format") == "markdown":
+            items = [item for item in content.split("\n\n") if item.strip()]
+            if operation in (0, 1):
+                content = "<ul>%s</ul>" % "".join(
+                    ["<li>%s</li>" % item.strip().lstrip("* ")
+                     for item in items])
+            elif operation == 4:
+                content = content.strip()
+            else:
+                content = "".join(["<li>%s</li>" % item for item in items])
+        rng = random.Random()
+        content = re.sub(r"<(\w+)>", lambda match: "<%s id='%s'>" % (
+            match.group(1), synthetic_id(rng)), content)
+        with self._lock:
+            html = thread["html"]
+            if operation == 0:
+                html += content
+            elif operation == 1:
+                html = content + html
+            else:
+                start, end = _element_span(html, args["section_id"])
+                if operation == 2:
+                    html = html[:end] + content + html[end:]
+                elif operation == 3:
+                    html = html[:start] + content + html[start:]
+                elif operation == 4:
+                    if not content.startswith("<"):
+                        # Replaces the text of the section.
+                        open_end = html.index(">", start) + 1
+                        close_start = html.rindex("</", start, end)
+                        content = html[start:open_end] + content + \
+                            html[close_start:end]
+                    html = html[:start] + content + html[end:]
+                else:
+                    html = html[:start] + html[end:]
+            thread["html"] = html
+            thread["thread"]["updated_usec"] += 1
+            for key in [key for key in self._encoded
+                        if key[0][1] == args["thread_id"]]:
+                del self._encoded[key]
+        return thread
+
+    def _encoded_body(self, payload, encoding):
+        """Serializes a response body, caching the encodings of threads."""
+        key = None
+        if isinstance(payload, tuple):
+            key = (payload, encoding)
+            with self._lock:
+                if key in self._encoded:
+                    return self._encoded[key]
+            payload = self.thread(payload[1])
+        if not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode()
+        if encoding == "gzip":
+            payload = gzip.compress(payload, 6)
+        elif encoding == "deflate":
+            payload = zlib.compress(payload, 6)
+        if key is not None:
+            with self._lock:
+                self._encoded[key] = payload
+        return payload
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY every
+    # response would wait out the client's delayed ACK.
+    disable_nagle_algorithm = True
+    stand_in = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        stand_in = self.stand_in
+        if self.headers.get("Upgrade", "").lower() == "websocket":
+            self._serve_websocket()
+            return
+        body = self._read_body()
+        if stand_in.latency:
+            time.sleep(stand_in.latency)
+        path, _, query = self.path.partition("?")
+        status, headers, payload = stand_in.respond(
+            method, path, query, body, self.headers)
+        encoding = None
+        if not isinstance(payload, bytes):
+            accepted = self.headers.get("Accept-Encoding", "")
+            if "gzip" in accepted:
+                encoding = "gzip"
+            elif "deflate" in accepted:
+                encoding = "deflate"
+        payload = stand_in._encoded_body(payload, encoding)
+        self.send_response(status)
+        if "Content-Type" not in headers:
+            self.send_header("Content-Type", "application/json")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        with stand_in._lock:
+            stand_in.requests += 1
+            stand_in.bytes_sent += len(payload)
+            stand_in.bytes_received += len(body)
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    return b"".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _serve_websocket(self):
+        stand_in = self.stand_in
+        self.close_connection = True
+        self._send_lock = threading.Lock()
+        accept = base64.b64encode(hashlib.sha1((self.headers.get(
+            "Sec-WebSocket-Key", "") + _WEBSOCKET_GUID).encode()).digest())
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept.decode())
+        self.end_headers()
+        with stand_in._lock:
+            stand_in._websockets.append(self)
+            stand_in.websocket_connections += 1
+        try:
+            while True:
+                opcode, payload = self._read_frame()
+                if opcode is None or opcode == 8:
+                    return
+                if opcode == 9:
+                    self.send_frame(10, payload)
+                elif opcode == 1 and json.loads(
+                        payload.decode()).get("type") == "heartbeat":
+                    with stand_in._lock:
+                        stand_in.heartbeats += 1
+                    self.send_frame(1, b'{"type": "alive"}')
+        except (OSError, ValueError):
+            pass
+        finally:
+            with stand_in._lock:
+                stand_in._websockets.remove(self)
+
+    def _read_frame(self):
+        """Returns the opcode and payload of the next client frame, or
+        (None, None) once the connection is closed.
+        """
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None, None
+        length = header[1] & 0x7f
+        if length == 126:
+            length = struct.unpack("!H", self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if header[1] & 0x80 else b"\0\0\0\0"
+        payload = self.rfile.read(length)
+        if len(payload) < length:
+            return None, None
+        return header[0] & 0x0f, bytes(
+            byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+    def send_frame(self, opcode, payload):
+        """Sends an unfragmented, unmasked frame; errors are ignored, as
+        the reading side notices closed connections.
+        """
+        if len(payload) < 126:
+            header = struct.pack("!BB", 0x80 | opcode, len(payload))
+        elif len(payload) < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, len(payload))
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, len(payload))
+        try:
+            with self._send_lock:
+                self.wfile.write(header + payload)
+        except OSError:
+            pass
+
+
+_WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _element_span(html, section_id):
+    """Returns the start and end offsets of the element with the given ID."""
+    position = html.find(" id='%s'" % section_id)
+    if position < 0:
+        raise ValueError("No section %s" % section_id)
+    start = html.rindex("<", 0, position)
+    tag = re.match(r"<(\w+)", html[start:]).group(1)
+    depth = 0
+    for match in re.compile(r"<(/?)%s\b[^>]*>" % tag).finditer(html, start):
+        depth += -1 if match.group(1) else 1
+        if not depth:
+            return start, match.end()
+    raise ValueError("Unclosed section %s" % section_id)
+
+
+def _form(body):
+    return dict((k, v[0]) for k, v in quip.urllib.parse.parse_qs(
+        body.decode()).items())
+
+
+def report(title, header, rows):
+    """Prints a table of benchmark results."""
+    widths = [max(len(str(row[i])) for row in [header] + rows)
+              for i in range(len(header))]
+    print(title)
+    for row in [header] + rows:
+        print("  ".join(str(cell).rjust(width)
+                        for cell, width in zip(row, widths)))
+    print("")
+
+
+def benchmark_transport(calls=50, document_size=1024 * 1024):
+    """Measures the bytes transferred and the time per `get_thread` call with
+    and without compression, and the JSON parse time per call for each
+    available JSON backend.
+    """
+    rows = []
+    with StandInServer(document_size=document_size) as server:
+        for compression in (False, True):
+            client = quip.QuipClient(
+                "token", base_url=server.base_url, compression=compression,
+                connection_pool=quip.ConnectionPool())
+            client.get_thread("warmup")
+            server.reset_counters()
+            start = time.time()
+            for i in range(calls):
+                client.get_thread("thread%d" % (i % 4))
+            elapsed = time.time() - start
+            rows.append([
+                "gzip" if compression else "identity",
+                "%.1f" % (server.bytes_sent / 1024.0 / calls),
+                "%.2f" % (elapsed * 1000 / calls)])
+        report("get_thread transport (%d calls, %d KB documents)" % (
+            calls, document_size // 1024),
+            ["encoding", "KB/call", "ms/call"], rows)
+
+        payload = json.dumps(server.thread("thread0")).encode()
+    backends = [("json", json.loads)]
+    if quip.json_loads is not json.loads:
+        backends.append((quip.json_loads.__module__ or "fast", quip.json_loads))
+    rows = []
+    for name, loads in backends:
+        start = time.time()
+        for _ in range(calls):
+            loads(payload)
+        rows.append([name, "%.2f" % ((time.time() - start) * 1000 / calls)])
+    report("JSON decoding (%d KB payload)" % (len(payload) // 1024),
+           ["backend", "ms/call"], rows)
+
+
+def measure(function):
+    """Returns the seconds taken by `function()` and the peak memory, in
+    bytes, allocated by Python while it ran.
+    """
+    tracemalloc.start()
+    try:
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def benchmark_parsing(document_size=20 * 1024 * 1024):
+    """Compares document lookups on a fully parsed tree with the
+    incremental parse of `QuipClient.find_document_element`.
+    """
+    client = quip.QuipClient()
+    document_html = synthetic_document(document_size)
+    tree = client.parse_document_html(document_html)
+    first_id = next(element.get("id") for element in tree.iter()
+                    if element.get("id"))
+    del tree
+    lookups = [
+        ("first section", lambda element: element.get("id") == first_id, 0),
+        ("first spreadsheet", lambda element: element.tag == "table", 0),
+        ("last list", lambda element: element.tag == "ul", -1),
+    ]
+    rows = []
+    for name, match, index in lookups:
+        full = measure(lambda: [
+            element for element in client.parse_document_html(
+                document_html).iter() if match(element)][index])
+        incremental = measure(lambda: client.find_document_element(
+            document_html, match, index))
+        rows.append([name, "%.3f" % full[0], "%.1f" % (full[1] / 1048576.0),
+                     "%.3f" % incremental[0],
+                     "%.1f" % (incremental[1] / 1048576.0)])
+    report("Document lookups (%d MB document)" % (document_size // 1048576),
+           ["lookup", "full s", "full MB", "incremental s", "incremental MB"],
+           rows)
+
+
+def benchmark_spreadsheet(rows=6250, columns=8):
+    """Compares `parse_spreadsheet_contents` with the columnar
+    `parse_spreadsheet_columns` on a spreadsheet of `rows` x `columns` cells.
+    """
+    client = quip.QuipClient()
+    spreadsheet = client.get_first_spreadsheet(document_html=synthetic_document(
+        0, rows=rows, columns=columns))
+    results = []
+    for name, parse in [
+            ("per-cell dicts", client.parse_spreadsheet_contents),
+            ("columns", client.parse_spreadsheet_columns)]:
+        seconds, peak = measure(lambda: parse(spreadsheet))
+        results.append([name, "%.3f" % seconds, "%.1f" % (peak / 1048576.0)])
+    report("Spreadsheet parsing (%d cells)" % (rows * columns),
+           ["format", "s", "MB"], results)
+
+
+def benchmark_threads(max_threads=64, calls=2000, latency=0.005):
+    """Measures the throughput of one thread-safe `QuipClient` shared by 1 to
+    `max_threads` threads, against a server that takes `latency` seconds
+    per request.
+    """
+    results = []
+    with StandInServer(document_size=16 * 1024, latency=latency) as server:
+        client = quip.QuipClient("token", base_url=server.base_url,
+                                 thread_safe=True)
+        threads = 1
+        while threads <= max_threads:
+            per_thread = max(1, calls // threads)
+
+            def work(worker):
+                with client.request_context(
+                        headers={"X-Worker": str(worker)}):
+                    for i in range(per_thread):
+                        client.get_thread("thread%d" % (i % 16))
+
+            workers = [threading.Thread(target=work, args=(i,))
+                       for i in range(threads)]
+            server.reset_counters()
+            start = time.time()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            seconds = time.time() - start
+            results.append([threads, server.requests,
+                            "%.0f" % (server.requests / seconds),
+                            "%.2f" % (seconds * 1000 * threads /
+                                      server.requests)])
+            threads *= 2
+    report("Shared client throughput (%.0f ms server latency)" % (
+        latency * 1000), ["threads", "requests", "requests/s", "ms/request"],
+        results)
+
+
+class _NullWriter(object):
+    def write(self, data):
+        pass
+
+
+def _get_thread(client, i):
+    client.get_thread("document0")
+
+
+def _get_first_spreadsheet(client, i):
+    spreadsheet = client.get_first_spreadsheet("document0")
+    client.parse_spreadsheet_contents(spreadsheet)
+
+
+def _update_spreadsheet_row(client, i):
+    client.update_spreadsheet_row(
+        "document1", "A", "row%d" % (i % 100), {"B": "value%d" % i})
+
+
+def _iter_messages(client, i):
+    for _ in client.iter_messages("document2"):
+        pass
+
+
+def _merge_comments(client, i):
+    client.merge_comments("original", ["duplicate"])
+
+
+def _download_blob(client, i):
+    client.download_blob("document3", "blob%d" % i, writer=_NullWriter())
+
+
+def _put_blob(client, i):
+    client.put_blob("document3", io.BytesIO(_upload_data()), name="upload.bin")
+
+
+_upload = []
+
+
+def _upload_data():
+    if not _upload:
+        _upload.append(os.urandom(4 * 1024 * 1024))
+    return _upload[0]
+
+
+# Scenario name: (function called with the client and the iteration,
+# iterations). Every scenario starts with an untimed warm-up call.
+SCENARIOS = collections.OrderedDict([
+    ("get_thread", (_get_thread, 50)),
+    ("get_first_spreadsheet", (_get_first_spreadsheet, 30)),
+    ("update_spreadsheet_row", (_update_spreadsheet_row, 30)),
+    ("iter_messages", (_iter_messages, 30)),
+    ("merge_comments", (_merge_comments, 5)),
+    ("download_blob", (_download_blob, 20)),
+    ("put_blob", (_put_blob, 20)),
+])
+
+
+def peak_rss():
+    """Returns the peak resident set size of this process in bytes, or None
+    if it cannot be determined on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of the given values."""
+    values = sorted(values)
+    rank = max(1, int(round(percent / 100.0 * len(values))))
+    return values[min(rank, len(values)) - 1]
+
+
+def run_scenario(name, base_url):
+    """Runs a scenario of `SCENARIOS` against the server at `base_url`.
+    Returns the latency of every iteration, the total time in seconds and
+    the peak RSS of the process.
+    """
+    function, iterations = SCENARIOS[name]
+    client = quip.QuipClient("token", base_url=base_url,
+                             connection_pool=quip.ConnectionPool())
+    function(client, 0)
+    latencies = []
+    start = time.time()
+    for i in range(1, iterations + 1):
+        call_start = time.time()
+        function(client, i)
+        latencies.append(time.time() - call_start)
+    return latencies, time.time() - start, peak_rss()
+
+
+def benchmark_suite(names=None):
+    """Runs the given `SCENARIOS` (default: all), each in a fresh process so
+    that its peak RSS is its own, against a shared stand-in server.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with StandInServer(document_size=1024 * 1024) as server:
+        for thread_id in ("document0", "document1", "document2"):
+            server.thread(thread_id)
+        server.copy_thread("original", "duplicate")
+        server.messages("duplicate")
+        for name in names or SCENARIOS:
+            server.reset_counters()
+            pool = context.Pool(1)
+            try:
+                latencies, seconds, rss = pool.apply(
+                    run_scenario, (name, server.base_url))
+            finally:
+                pool.terminate()
+            calls = len(latencies) + 1
+            results.append([
+                name, len(latencies),
+                "%.2f" % (percentile(latencies, 50) * 1000),
+                "%.2f" % (percentile(latencies, 99) * 1000),
+                "%.1f" % (len(latencies) / seconds),
+                "%.1f" % ((server.bytes_sent + server.bytes_received) /
+                          1024.0 / calls),
+                "%.1f" % (rss / 1048576.0) if rss else "n/a"])
+    report("Client scenarios (1 MB documents, %d MB blobs)" % (
+        server.blob_size // 1048576),
+        ["scenario", "calls", "p50 ms", "p99 ms", "calls/s", "KB/call",
+         "peak RSS MB"], results)
+
+
+def benchmark_search(documents=200, document_size=32 * 1024, marked=5):
+    """Measures indexing and query times of `quip_mirror.SearchIndex` over
+    synthetic documents, and how many of the paragraphs with comments and
+    the list items with nested lists, `marked` of each per document, are
+    found by a word outside the comment or nested list.
+    """
+    import sqlite3
+    import quip_mirror
+    index = quip_mirror.SearchIndex(sqlite3.connect(":memory:"))
+    rng = random.Random(0)
+    threads = []
+    expected = {}
+    for i in range(documents):
+        extra = []
+        for j in range(marked):
+            word = "commented%dx%d" % (i, j)
+            expected[word] = synthetic_id(rng)
+            extra.append(
+                "<p id='%s'>%s %s <annotation id='%s'>%s</annotation> %s</p>"
+                % (expected[word], rng.choice(WORDS), word, synthetic_id(rng),
+                   rng.choice(WORDS), rng.choice(WORDS)))
+            word = "nested%dx%d" % (i, j)
+            expected[word] = synthetic_id(rng)
+            extra.append(
+                "<ul id='%s'><li id='%s'>%s<ul id='%s'><li id='%s'>%s</li>"
+                "</ul></li></ul>" % (
+                    synthetic_id(rng), expected[word], word,
+                    synthetic_id(rng), synthetic_id(rng), rng.choice(WORDS)))
+        threads.append({
+            "thread": {"id": "thread%d" % i, "title": "Thread %d" % i,
+                       "updated_usec": 1},
+            "html": synthetic_document(document_size, i) + "".join(extra),
+        })
+    start = time.time()
+    for thread in threads:
+        index.index_thread(thread)
+    indexing = time.time() - start
+    sections = index.connection.execute(
+        "SELECT COUNT(*) FROM search_sections").fetchone()[0]
+    latencies = []
+    found = {"commented": 0, "nested": 0}
+    for word, section_id in sorted(expected.items()):
+        start = time.time()
+        results = index.search(word)
+        latencies.append(time.time() - start)
+        if [result.section_id for result in results] == [section_id]:
+            found[word.rstrip("0123456789x")] += 1
+    for _ in range(200):
+        start = time.time()
+        index.search(" ".join(rng.sample(WORDS, 2)))
+        latencies.append(time.time() - start)
+    total = documents * marked
+    report("Full-text index (%d documents, %d sections)" % (
+        documents, sections), ["measurement", "value"], [
+            ["documents/s", "%.1f" % (documents / indexing)],
+            ["sections/s", "%.0f" % (sections / indexing)],
+            ["query p50 ms", "%.2f" % (percentile(latencies, 50) * 1000)],
+            ["query p99 ms", "%.2f" % (percentile(latencies, 99) * 1000)],
+            ["commented paragraphs found",
+             "%d of %d" % (found["commented"], total)],
+            ["nested list items found", "%d of %d" % (found["nested"], total)],
+        ])
+
+
+def _wait_for(condition, timeout=10):
+    """Waits until `condition()` is true, and returns it."""
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+def benchmark_websocket(bursts=(100, 1000, 5000), reconnects=5,
+                        heartbeat_interval=0.2):
+    """Measures a `quip.WebsocketListener` against the stand-in's websocket:
+    the throughput and dispatch latency of bursts of published events, the
+    time it takes to reconnect after the server drops the connection, and
+    the heartbeats sent meanwhile.
+    """
+    latencies = []
+    with StandInServer(document_size=10 * 1024) as server:
+        client = quip.QuipClient("token", base_url=server.base_url)
+        listener = quip.WebsocketListener(
+            client,
+            on_message=lambda event: latencies.append(
+                time.time() - event.message["sent"]),
+            heartbeat_interval=heartbeat_interval, backoff=0.05)
+        started = time.time()
+        listener.start()
+        burst_rows = []
+        reconnect_times = []
+        try:
+            _wait_for(lambda: server.open_websockets == 1)
+            for events in bursts:
+                del latencies[:]
+                start = time.time()
+                for i in range(events):
+                    server.publish({
+                        "type": "message",
+                        "thread": {"id": "thread%d" % (i % 10)},
+                        "message": {"id": "message%d" % i,
+                                    "sent": time.time(),
+                                    "text": "Message %d" % i},
+                        "user": {"id": "user%d" % (i % 5)},
+                    })
+                _wait_for(lambda: len(latencies) >= events)
+                seconds = time.time() - start
+                burst_rows.append([
+                    events, len(latencies),
+                    "%d" % (len(latencies) / seconds),
+                    "%.2f" % (percentile(latencies or [0], 50) * 1000),
+                    "%.2f" % (percentile(latencies or [0], 99) * 1000)])
+            for _ in range(reconnects):
+                connections = server.websocket_connections
+                start = time.time()
+                server.drop_websockets()
+                if _wait_for(lambda: server.websocket_connections >
+                             connections and server.open_websockets == 1):
+                    reconnect_times.append(time.time() - start)
+        finally:
+            listener.stop(timeout=5)
+        seconds = time.time() - started
+        report("Websocket event dispatch",
+               ["events", "received", "events/s", "p50 ms", "p99 ms"],
+               burst_rows)
+        report("Websocket reconnection (%d drops)" % reconnects,
+               ["reconnected", "p50 ms", "max ms", "heartbeats/s"], [[
+                   len(reconnect_times),
+                   "%.1f" % (percentile(reconnect_times or [0], 50) * 1000),
+                   "%.1f" % (max(reconnect_times or [0]) * 1000),
+                   "%.1f" % (server.heartbeats / seconds)]])
+
+
+BENCHMARKS = {
+    "parsing": benchmark_parsing,
+    "search": benchmark_search,
+    "spreadsheet": benchmark_spreadsheet,
+    "suite": benchmark_suite,
+    "threads": benchmark_threads,
+    "transport": benchmark_transport,
+    "websocket": benchmark_websocket,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("benchmarks", nargs="*", choices=sorted(BENCHMARKS),
+                        help="benchmarks to run (default: all)")
+    args = parser.parse_args()
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
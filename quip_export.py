@@ -0,0 +1,260 @@
+"""Exports Quip folder trees to disk.
+
+Typical usage:
+
+    client = quip.QuipClient(access_token=..., connection_pool=...)
+    exporter = quip_export.FolderExporter(client, "/data/quip-export")
+    exporter.export([user["private_folder_id"]])
+
+The exporter walks the folders breadth-first, looks folders and threads up
+in batches through `get_folders` and `get_threads`, and processes the
+batches on a pool of worker threads. Everything is stored by content hash,
+so identical documents and blobs are written once:
+
+    folders/<folder id>.json     the folder, as returned by the API
+    threads/<thread id>.json     the thread metadata, with the hashes of its
+                                 HTML ("html_hash") and blobs ("blobs")
+    documents/<sha1>.html        document HTML
+    blobs/<sha1>                 blob contents
+
+Progress is saved to a checkpoint file after every batch; if the export is
+interrupted, calling `export` again resumes where it stopped.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import quip
+
+BLOB_PATTERN = re.compile(r"/blob/([\w-]+)/([\w-]+)")
+
+
+class FolderExporter(object):
+    """Exports folder trees, with their threads and blobs, to a directory"""
+
+    def __init__(self, client, directory, max_workers=8, batch_size=50,
+                 export_blobs=True, checkpoint_path=None):
+        self.client = client
+        self.directory = directory
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.export_blobs = export_blobs
+        self.checkpoint_path = checkpoint_path or os.path.join(
+            directory, "checkpoint.json")
+        self._lock = threading.Lock()
+        self._state = None
+        self._blob_hashes = set()
+
+    def export(self, folder_ids):
+        """Exports the given folders and everything below them. Returns the
+        number of exported folders, threads and blobs, and the IDs that
+        could not be exported.
+
+        If a checkpoint of an interrupted export exists, it is resumed and
+        `folder_ids` are ignored.
+        """
+        for name in ("folders", "threads", "documents", "blobs"):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        self._state = self._load_checkpoint() or {
+            "queue": list(folder_ids),
+            "seen_folders": list(folder_ids),
+            "pending_threads": [],
+            "seen_threads": [],
+            "blobs": {},
+            "failed": [],
+            "counts": {"folders": 0, "threads": 0, "blobs": 0},
+        }
+        self._blob_hashes = set(self._state["blobs"].values())
+        seen_folders = set(self._state["seen_folders"])
+        seen_threads = set(self._state["seen_threads"])
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while self._state["queue"] or self._state["pending_threads"]:
+                # One round: a slice of the folder queue, breadth-first, then
+                # the threads discovered so far.
+                size = self.batch_size * self.max_workers
+                folder_ids = self._state["queue"][:size]
+                self._state["queue"] = self._state["queue"][size:]
+                for folders in executor.map(
+                        self._fetch_folders, self._chunks(folder_ids)):
+                    for folder in folders:
+                        for child in folder.get("children", []):
+                            if child.get("folder_id") and \
+                                    child["folder_id"] not in seen_folders:
+                                seen_folders.add(child["folder_id"])
+                                self._state["queue"].append(child["folder_id"])
+                            elif child.get("thread_id") and \
+                                    child["thread_id"] not in seen_threads:
+                                seen_threads.add(child["thread_id"])
+                                self._state["pending_threads"].append(
+                                    child["thread_id"])
+                self._state["seen_folders"] = list(seen_folders)
+                self._state["seen_threads"] = list(seen_threads)
+                self._save_checkpoint()
+
+                thread_ids = self._state["pending_threads"][:size]
+                list(executor.map(
+                    self._export_threads, self._chunks(thread_ids)))
+                self._state["pending_threads"] = \
+                    self._state["pending_threads"][len(thread_ids):]
+                self._save_checkpoint()
+        os.remove(self.checkpoint_path)
+        result = dict(self._state["counts"])
+        result["failed"] = self._state["failed"]
+        return result
+
+    def _fetch_folders(self, folder_ids):
+        try:
+            folders = self._check_batch(
+                folder_ids, self.client.get_folders(folder_ids))
+        except Exception:
+            # Retry one by one, so that a single inaccessible folder does not
+            # fail the whole batch.
+            folders = []
+            for folder_id in folder_ids:
+                try:
+                    folders.append(self.client.get_folder(folder_id))
+                except Exception as error:
+                    self._fail(folder_id, error)
+        for folder in folders:
+            self._write_json(os.path.join(
+                "folders", folder["folder"]["id"] + ".json"), folder)
+        self._count("folders", len(folders))
+        return folders
+
+    def _export_threads(self, thread_ids):
+        try:
+            threads = self._check_batch(
+                thread_ids, self.client.get_threads(thread_ids))
+        except Exception:
+            threads = []
+            for thread_id in thread_ids:
+                try:
+                    threads.append(self.client.get_thread(thread_id))
+                except Exception as error:
+                    self._fail(thread_id, error)
+        for thread in threads:
+            try:
+                self._export_thread(thread)
+            except Exception as error:
+                self._fail(thread["thread"]["id"], error)
+
+    def _check_batch(self, ids, results):
+        """Returns the values of a batch lookup, failing the IDs that it left
+        out, e.g. because they are not accessible.
+        """
+        for id in ids:
+            if id not in results:
+                self._fail(id, "not returned by the batch lookup")
+        return list(results.values())
+
+    def _export_thread(self, thread):
+        thread_id = thread["thread"]["id"]
+        metadata = dict((k, v) for k, v in quip.iteritems(thread)
+                        if k != "html")
+        html = thread.get("html")
+        if html:
+            data = html.encode("utf-8")
+            metadata["html_hash"] = hashlib.sha1(data).hexdigest()
+            path = os.path.join("documents", metadata["html_hash"] + ".html")
+            if not os.path.exists(os.path.join(self.directory, path)):
+                self._write(path, data)
+            if self.export_blobs:
+                metadata["blobs"] = {}
+                for blob_thread_id, blob_id in set(BLOB_PATTERN.findall(html)):
+                    metadata["blobs"][blob_id] = self._export_blob(
+                        blob_thread_id, blob_id)
+        self._write_json(os.path.join("threads", thread_id + ".json"),
+                         metadata)
+        self._count("threads", 1)
+
+    def _export_blob(self, thread_id, blob_id):
+        with self._lock:
+            if blob_id in self._state["blobs"]:
+                return self._state["blobs"][blob_id]
+        directory = os.path.join(self.directory, "blobs")
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            digest = hashlib.sha1()
+            with os.fdopen(handle, "wb") as temp:
+                writer = _HashingWriter(temp, digest)
+                self.client.download_blob(thread_id, blob_id, writer=writer)
+            blob_hash = digest.hexdigest()
+            path = os.path.join(directory, blob_hash)
+            if os.path.exists(path):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self._lock:
+            if blob_hash not in self._blob_hashes:
+                # Also counts blobs written before an interrupted export
+                # resumed, which the checkpoint does not list yet.
+                self._blob_hashes.add(blob_hash)
+                self._state["counts"]["blobs"] += 1
+            self._state["blobs"][blob_id] = blob_hash
+        return blob_hash
+
+    def _chunks(self, ids):
+        return [ids[i:i + self.batch_size]
+                for i in range(0, len(ids), self.batch_size)]
+
+    def _count(self, name, count):
+        with self._lock:
+            self._state["counts"][name] += count
+
+    def _fail(self, id, error):
+        logging.warning("Could not export %s: %s", id, error)
+        with self._lock:
+            self._state["failed"].append(id)
+
+    def _write_json(self, path, data):
+        self._write(path, json.dumps(data, sort_keys=True).encode("utf-8"))
+
+    def _write(self, path, data):
+        # Workers can write the same content-addressed file at once, so each
+        # writes to a temporary file of its own.
+        path = os.path.join(self.directory, path)
+        handle, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as f:
+            return json.load(f)
+
+    def _save_checkpoint(self):
+        with self._lock:
+            data = json.dumps(self._state)
+        with open(self.checkpoint_path + ".part", "w") as f:
+            f.write(data)
+        os.replace(self.checkpoint_path + ".part", self.checkpoint_path)
+
+
+class _HashingWriter(object):
+    def __init__(self, fileobj, digest):
+        self.fileobj = fileobj
+        self.digest = digest
+
+    def write(self, data):
+        self.digest.update(data)
+        self.fileobj.write(data)
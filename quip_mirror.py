@@ -0,0 +1,347 @@
+"""An incremental local mirror of Quip threads, stored in SQLite.
+
+Typical usage:
+
+    client = quip.QuipClient(access_token=...)
+    mirror = quip_mirror.QuipMirror(client, "/data/quip.sqlite3")
+    mirror.sync(thread_ids=[...])
+    thread = mirror.get_thread(thread_id)
+
+Every mirrored thread keeps the `updated_usec` it was last fetched at. A
+sync walks `iter_recent_threads` down to the newest `updated_usec` seen by
+the previous sync, and fetches (in `get_threads` batches) only the threads
+whose `updated_usec` moved past their stored one, plus requested threads
+that are not mirrored yet. New messages of changed threads are fetched with
+`iter_messages` down to the newest mirrored message. Every batch is written
+in a single transaction.
+
+Threads that the server no longer returns are deleted from the mirror. As
+the recent threads feed does not report deletions, pass `check_deleted` to
+look every mirrored thread up again.
+
+With `full_text`, the mirror also maintains a `SearchIndex`, an SQLite FTS5
+index over the sections of the mirrored documents:
+
+    mirror = quip_mirror.QuipMirror(client, path, full_text=True)
+    mirror.sync()
+    for result in mirror.search_index.search("quarterly revenue"):
+        print(result.thread_id, result.section_id, result.snippet)
+"""
+
+import collections
+import json
+import re
+import sqlite3
+import xml.etree.cElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+import quip
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    link TEXT,
+    type TEXT,
+    created_usec INTEGER,
+    updated_usec INTEGER,
+    html TEXT,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    author_id TEXT,
+    created_usec INTEGER,
+    text TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_thread
+    ON messages (thread_id, created_usec);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS search_sections USING fts5 (
+    thread_id UNINDEXED,
+    section_id UNINDEXED,
+    title,
+    text,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS search_threads (
+    id TEXT PRIMARY KEY,
+    updated_usec INTEGER
+);
+"""
+
+SearchResult = collections.namedtuple(
+    "SearchResult", ["thread_id", "section_id", "title", "snippet", "rank"])
+
+
+class SearchIndex(object):
+    """A full-text index over the sections of Quip documents.
+
+    Every section of a document (an element with an ID, other than an
+    annotation) is indexed with its own plain text, without that of the
+    sections nested in it, and the document title, so that results point at
+    a thread and a section within it. Threads are only re-indexed when their
+    `updated_usec` changes.
+    """
+
+    def __init__(self, connection, client=None):
+        self.connection = connection
+        self.client = client if client else quip.QuipClient()
+        self.connection.executescript(SEARCH_SCHEMA)
+
+    def index_thread(self, thread):
+        """Indexes the given thread, as returned by `QuipClient.get_thread`.
+        Returns False if the thread was already indexed at its
+        `updated_usec`.
+        """
+        metadata = thread["thread"]
+        row = self.connection.execute(
+            "SELECT updated_usec FROM search_threads WHERE id = ?",
+            (metadata["id"],)).fetchone()
+        if row is not None and row[0] == metadata["updated_usec"]:
+            return False
+        title = metadata.get("title")
+        rows = [(metadata["id"], section_id, title, text)
+                for section_id, text in self._sections(thread.get("html"))]
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM search_sections WHERE thread_id = ?",
+                (metadata["id"],))
+            self.connection.executemany(
+                "INSERT INTO search_sections (thread_id, section_id, title, "
+                "text) VALUES (?, ?, ?, ?)", rows)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO search_threads (id, updated_usec) "
+                "VALUES (?, ?)", (metadata["id"], metadata["updated_usec"]))
+        return True
+
+    def remove_thread(self, thread_id):
+        """Removes the given thread from the index."""
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM search_sections WHERE thread_id = ?",
+                (thread_id,))
+            self.connection.execute(
+                "DELETE FROM search_threads WHERE id = ?", (thread_id,))
+
+    def search(self, query, limit=20, raw=False):
+        """Returns the best `SearchResult`s for the given query, best first.
+
+        Every word of the query must match. With `raw`, the query is passed
+        to SQLite as an FTS5 query expression instead.
+        """
+        if not raw:
+            query = " ".join(['"%s"' % word.replace('"', '""')
+                              for word in query.split()])
+            if not query:
+                return []
+        return [SearchResult(*row) for row in self.connection.execute(
+            "SELECT thread_id, section_id, title, "
+            "snippet(search_sections, 3, '[', ']', '...', 12), "
+            "bm25(search_sections) AS rank FROM search_sections "
+            "WHERE search_sections MATCH ? ORDER BY rank LIMIT ?",
+            (query, limit))]
+
+    def _sections(self, document_html):
+        if not document_html:
+            return []
+        try:
+            tree = self.client.parse_document_html(document_html)
+        except xml.etree.cElementTree.ParseError:
+            # Index what we can of malformed documents, as a single section.
+            text = re.sub(r"<[^>]+>", " ", document_html)
+            return [(None, " ".join(text.split()))]
+        sections = []
+        self._collect_sections(tree, sections)
+        return sections
+
+    def _collect_sections(self, element, sections, parts=None):
+        """Appends the ID and text of every section within the given element
+        to `sections`, in document order, and the text outside of sections
+        to `parts`.
+
+        Like `quip.ParsedDocument`, annotations are not sections. The text of
+        a section leaves out the sections nested in it, e.g. the items of a
+        list nested in a list item, which are indexed by themselves.
+        """
+        for child in element:
+            if child.get("id") and child.tag != "annotation":
+                position = len(sections)
+                own = [child.text or ""]
+                self._collect_sections(child, sections, own)
+                text = " ".join("".join(own).replace(u"\u200b", "").split())
+                if text:
+                    sections.insert(position, (child.get("id"), text))
+            else:
+                if parts is not None:
+                    parts.append(child.text or "")
+                self._collect_sections(child, sections, parts)
+            if parts is not None:
+                parts.append(child.tail or "")
+
+
+class QuipMirror(object):
+    """A local SQLite mirror of Quip threads and their messages"""
+
+    def __init__(self, client, path, batch_size=50, max_workers=4,
+                 sync_messages=True, full_text=False):
+        self.client = client
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.sync_messages = sync_messages
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        self.search_index = (SearchIndex(self.connection, client)
+                             if full_text else None)
+
+    def close(self):
+        self.connection.close()
+
+    def sync(self, thread_ids=(), check_deleted=False):
+        """Brings the mirror up to date. Returns the number of threads that
+        were updated and deleted, and of messages that were added.
+
+        `thread_ids` are mirrored in addition to the recently updated
+        threads of the authenticated user.
+        """
+        watermarks = dict(self.connection.execute(
+            "SELECT id, updated_usec FROM threads"))
+        newest_messages = dict(self.connection.execute(
+            "SELECT thread_id, MAX(created_usec) FROM messages "
+            "GROUP BY thread_id"))
+        recent_usec = self._get_state("recent_updated_usec")
+        newest_usec = recent_usec
+        changed = []
+        for thread in self.client.iter_recent_threads(
+                min_updated_usec=recent_usec):
+            thread_id = thread["thread"]["id"]
+            updated_usec = thread["thread"]["updated_usec"]
+            newest_usec = max(newest_usec or 0, updated_usec)
+            if watermarks.get(thread_id, -1) < updated_usec:
+                changed.append(thread_id)
+        changed.extend([thread_id for thread_id in thread_ids
+                        if thread_id not in watermarks])
+        if check_deleted:
+            changed.extend(watermarks)
+        changed = list(dict.fromkeys(changed))
+
+        result = {"updated": 0, "deleted": 0, "messages": 0}
+        chunks = [changed[i:i + self.batch_size]
+                  for i in range(0, len(changed), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for ids, threads in zip(chunks, executor.map(
+                    self._fetch_threads, chunks)):
+                updated = [thread for thread in threads.values()
+                           if watermarks.get(thread["thread"]["id"], -1) <
+                           thread["thread"]["updated_usec"]]
+                deleted = [thread_id for thread_id in ids
+                           if thread_id not in threads]
+                messages = []
+                if self.sync_messages:
+                    updated_ids = [thread["thread"]["id"] for thread in updated]
+                    for batch in executor.map(
+                            self._fetch_new_messages, updated_ids,
+                            [newest_messages.get(thread_id)
+                             for thread_id in updated_ids]):
+                        messages.extend(batch)
+                self._write(updated, deleted, messages)
+                if self.search_index is not None:
+                    for thread in updated:
+                        self.search_index.index_thread(thread)
+                    for thread_id in deleted:
+                        self.search_index.remove_thread(thread_id)
+                result["updated"] += len(updated)
+                result["deleted"] += len(deleted)
+                result["messages"] += len(messages)
+        if newest_usec is not None:
+            self._set_state("recent_updated_usec", newest_usec)
+        return result
+
+    def get_thread(self, thread_id):
+        """Returns the mirrored thread, in the format of
+        `QuipClient.get_thread`, or None.
+        """
+        row = self.connection.execute(
+            "SELECT data, html FROM threads WHERE id = ?",
+            (thread_id,)).fetchone()
+        if row is None:
+            return None
+        thread = json.loads(row["data"])
+        if row["html"] is not None:
+            thread["html"] = row["html"]
+        return thread
+
+    def get_messages(self, thread_id):
+        """Returns the mirrored messages of the thread, most recent first."""
+        return [json.loads(row["data"]) for row in self.connection.execute(
+            "SELECT data FROM messages WHERE thread_id = ? "
+            "ORDER BY created_usec DESC", (thread_id,))]
+
+    def _fetch_threads(self, thread_ids):
+        try:
+            return self.client.get_threads(thread_ids)
+        except quip.QuipError:
+            # Look the threads up one by one, so that a deleted thread does
+            # not fail the whole batch.
+            threads = {}
+            for thread_id in thread_ids:
+                try:
+                    threads[thread_id] = self.client.get_thread(thread_id)
+                except quip.QuipError as error:
+                    if error.code not in (400, 403, 404):
+                        raise
+            return threads
+
+    def _fetch_new_messages(self, thread_id, newest_usec):
+        return [(thread_id, message) for message in self.client.iter_messages(
+            thread_id, min_created_usec=None if newest_usec is None
+            else newest_usec + 1)]
+
+    def _write(self, threads, deleted, messages):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO threads (id, title, link, type, "
+                "created_usec, updated_usec, html, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._thread_row(thread) for thread in threads])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO messages (id, thread_id, author_id, "
+                "created_usec, text, data) VALUES (?, ?, ?, ?, ?, ?)",
+                [(message["id"], thread_id, message.get("author_id"),
+                  message.get("created_usec"), message.get("text"),
+                  json.dumps(message)) for thread_id, message in messages])
+            self.connection.executemany(
+                "DELETE FROM messages WHERE thread_id = ?",
+                [(thread_id,) for thread_id in deleted])
+            self.connection.executemany(
+                "DELETE FROM threads WHERE id = ?",
+                [(thread_id,) for thread_id in deleted])
+
+    def _thread_row(self, thread):
+        data = dict((k, v) for k, v in quip.iteritems(thread) if k != "html")
+        metadata = thread["thread"]
+        return (metadata["id"], metadata.get("title"), metadata.get("link"),
+                metadata.get("type"), metadata.get("created_usec"),
+                metadata["updated_usec"], thread.get("html"),
+                json.dumps(data))
+
+    def _get_state(self, key):
+        row = self.connection.execute(
+            "SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_state(self, key, value):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+                (key, json.dumps(value)))